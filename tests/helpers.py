@@ -0,0 +1,45 @@
+# Shared setup for the tests. These need the App Engine SDK (and its
+# bundled webapp2) on sys.path; run them from the repository root with
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'www'))
+os.environ.setdefault('SERVER_SOFTWARE', 'Development')
+
+from google.appengine.ext import testbed
+import webapp2
+
+import go
+
+
+class GoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+
+        # The per-instance caches outlive the datastore between tests.
+        go.GameStateCache._cache.clear()
+        go.GameCache._entities.clear()
+        go.ModelCache._players.clear()
+        go.Game._history_boards.clear()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def call(self, handler_class, method='post', params=None, args=(), ip='1.2.3.4'):
+        request = webapp2.Request.blank('/', POST=params or {}, remote_addr=ip)
+        response = webapp2.Response()
+        handler = handler_class(request, response)
+        getattr(handler, method)(*args)
+        return response
+
+    def new_game(self, board_size_index=2, handicap_index=0, komi_index=0):
+        # (black cookie, white cookie)
+        your_cookie, your_turn = go.CreateGameHandler().create_game('alice', 'alice@example.com', go.CONST.Email_Contact, 'bob', 'bob@example.com', go.CONST.Email_Contact, go.CONST.Black_Color, board_size_index, handicap_index, komi_index)
+        return your_cookie, go.ModelCache.player_by_cookie(your_cookie).get_opponent().cookie
@@ -0,0 +1,45 @@
+from helpers import GoTestCase, go
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+
+class CacheLeaseTest(GoTestCase):
+    def failing_get(self, *args, **kwargs):
+        raise db.Timeout()
+
+    def test_player_lease_released_when_lookup_fails(self):
+        get_by_cookie = go.Player.__dict__['get_by_cookie']
+        go.Player.get_by_cookie = staticmethod(self.failing_get)
+        try:
+            self.assertRaises(db.Timeout, go.ModelCache.player_by_cookie, 'somecookie')
+        finally:
+            go.Player.get_by_cookie = get_by_cookie
+        self.assertEqual(memcache.get('lease:player:somecookie'), None)
+
+    def test_game_lease_released_when_get_fails(self):
+        black, white = self.new_game()
+        game_key = go.Player.game.get_value_for_datastore(go.ModelCache.player_by_cookie(black))
+        memcache.flush_all()
+        go.Game.get = classmethod(self.failing_get)
+        try:
+            self.assertRaises(db.Timeout, go.GameCache.get, game_key)
+        finally:
+            del go.Game.get
+        self.assertEqual(memcache.get('lease:' + str(game_key)), None)
+        self.assertEqual(go.GameCache.get(game_key).key(), game_key)
+
+    def test_waiter_gets_holders_result(self):
+        black, white = self.new_game()
+        go.ModelCache.clear_cookie(black)
+        memcache.add('lease:player:' + black, 1)
+        player = go.Player.get_by_key_name(go.Player.key_name_for(black))
+        memcache.set('player:' + black, player)
+        self.assertEqual(go.ModelCache.player_by_cookie(black).cookie, black)
+
+    def test_cookie_naming_a_lease(self):
+        black, white = self.new_game()
+        go.ModelCache.clear_cookie(black)
+        memcache.add('lease:' + black, 1)
+        self.assertEqual(go.ModelCache.player_by_cookie('lease:' + black), None)
+        self.assertEqual(go.ModelCache.players_by_cookies(['lease:' + black]), {})
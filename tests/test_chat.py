@@ -0,0 +1,38 @@
+import json
+
+from helpers import GoTestCase, go
+
+
+class ChatCountTest(GoTestCase):
+    def add_chat(self, cookie, message, last_chat_seen):
+        response = self.call(go.AddChatHandler, params={'your_cookie': cookie, 'message': message, 'last_chat_seen': last_chat_seen})
+        return json.loads(response.body)
+
+    def recent_chat(self, cookie, last_chat_seen):
+        response = self.call(go.RecentChatHandler, params={'your_cookie': cookie, 'last_chat_seen': last_chat_seen})
+        return json.loads(response.body)
+
+    def test_chat_count_is_the_total(self):
+        black, white = self.new_game()
+        result = self.add_chat(black, 'hello', -1)
+        self.assertEqual((result['chat_count'], len(result['recent_chats'])), (1, 1))
+
+        # White hasn't polled yet, so sees both lines.
+        result = self.add_chat(white, 'hi', -1)
+        self.assertEqual(result['chat_count'], 2)
+        self.assertEqual([chat['message'] for chat in result['recent_chats']], ['hello', 'hi'])
+
+        result = self.recent_chat(black, 1)
+        self.assertEqual(result['chat_count'], 2)
+        self.assertEqual([chat['message'] for chat in result['recent_chats']], ['hi'])
+
+        result = self.recent_chat(black, 2)
+        self.assertEqual((result['chat_count'], result['recent_chats']), (2, []))
+
+    def test_chat_count_after_a_stale_count(self):
+        black, white = self.new_game()
+        self.add_chat(black, 'hello', -1)
+
+        # A count from before the page was refreshed, say.
+        result = self.recent_chat(white, 7)
+        self.assertEqual((result['chat_count'], result['recent_chats']), (1, []))
@@ -0,0 +1,50 @@
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+def chain_summary(chains):
+    return sorted((chain.color, sorted(chain.stones), sorted(chain.liberties)) for chain in chains.chains.values())
+
+
+class CloneTest(GoTestCase):
+    def make_board(self):
+        board = go.GameBoard(2)
+        for x, y in ((3, 3), (3, 4), (4, 4)):
+            board.set(x, y, CONST.Black_Color)
+        board.set(4, 3, CONST.White_Color)
+        board.is_stone_in_suicide(3, 3)
+        return board
+
+    def test_clone_shares_chains(self):
+        board = self.make_board()
+        clone = board.clone()
+        self.assertTrue(clone._chains is board._chains)
+        self.assertTrue(clone.board is board.board)
+
+    def test_writes_copy_the_chains(self):
+        board = self.make_board()
+        before = chain_summary(board._chains)
+        chains = board._chains
+        clone = board.clone()
+        clone.play(5, 3, CONST.Black_Color)
+        clone.play(4, 2, CONST.Black_Color)
+
+        # The clone kept its chains up to date rather than rebuilding them...
+        self.assertTrue(clone._chains is not None and clone._chains is not chains)
+        self.assertEqual(chain_summary(clone._chains), chain_summary(go.ChainTracker(clone)))
+        self.assertEqual(clone.get(4, 3), CONST.No_Color)
+
+        # ...and left the original alone.
+        self.assertTrue(board._chains is chains)
+        self.assertEqual(chain_summary(board._chains), before)
+        self.assertEqual(board.get(4, 3), CONST.White_Color)
+
+    def test_original_writes_leave_the_clone(self):
+        board = self.make_board()
+        clone = board.clone()
+        before = chain_summary(clone._chains)
+        board.play(5, 3, CONST.Black_Color)
+        self.assertEqual(chain_summary(clone._chains), before)
+        self.assertEqual(clone.get(5, 3), CONST.No_Color)
+        self.assertEqual(chain_summary(board._chains), chain_summary(go.ChainTracker(board)))
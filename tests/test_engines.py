@@ -0,0 +1,115 @@
+import random
+
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+def new_state(board_size_index, engine):
+    state = go.GameState()
+    board = go.GameBoard(board_size_index, komi_index=1)
+    board.use_engine(engine)
+    state.set_board(board)
+    state.set_whose_move(CONST.Black_Color)
+    return state
+
+
+def position(state):
+    board = state.get_board()
+    return (board.get_state_string(), board.get_position_hash(), state.get_white_stones_captured(), state.get_black_stones_captured())
+
+
+class EngineTest(GoTestCase):
+    # Replays the same random games with both engines; everything either
+    # engine reports must agree at every step.
+
+    def play_game(self, board_size_index, seed, moves=300):
+        rnd = random.Random(seed)
+        chains = new_state(board_size_index, CONST.Chain_Engine)
+        bitboards = new_state(board_size_index, CONST.Bitboard_Engine)
+        captures = 0
+        for i in range(moves):
+            board = chains.get_board()
+            x = rnd.randrange(board.get_width())
+            y = rnd.randrange(board.get_height())
+            if board.get(x, y) != CONST.No_Color:
+                continue
+            color = chains.whose_move
+            next_chains, chains_move = chains.after_move(x, y, color)
+            next_bitboards, bitboards_move = bitboards.after_move(x, y, color)
+            self.assertEqual((chains_move.ataris, sorted(chains_move.captures)), (bitboards_move.ataris, sorted(bitboards_move.captures)))
+            self.assertEqual(position(next_chains), position(next_bitboards))
+
+            suicide = next_chains.get_board().is_stone_in_suicide(x, y)
+            self.assertEqual(suicide, next_bitboards.get_board().is_stone_in_suicide(x, y))
+            if suicide:
+                continue
+
+            # Ko: the position before this one may not come back.
+            ko = next_chains.get_board().get_position_hash() == chains.get_previous_position_hash()
+            self.assertEqual(ko, next_bitboards.get_board().get_position_hash() == bitboards.get_previous_position_hash())
+            if ko:
+                continue
+
+            captures += len(chains_move.captures)
+            chains, bitboards = next_chains, next_bitboards
+        return chains, bitboards, captures
+
+    def score(self, chains, bitboards, seed):
+        rnd = random.Random(seed)
+        chains = chains.after_pass(chains.whose_move).after_pass(go.opposite_color(chains.whose_move))
+        bitboards = bitboards.after_pass(bitboards.whose_move).after_pass(go.opposite_color(bitboards.whose_move))
+        self.assertEqual(position(chains), position(bitboards))
+        self.assertEqual((chains.get_black_territory(), chains.get_white_territory()), (bitboards.get_black_territory(), bitboards.get_white_territory()))
+
+        # Mark some stones dead (and some back to life.)
+        board = chains.get_board()
+        for i in range(20):
+            x = rnd.randrange(board.get_width())
+            y = rnd.randrange(board.get_height())
+            piece = board.get(x, y)
+            if piece == CONST.No_Color:
+                continue
+            owner = go.opposite_color(piece) if board.get_owner(x, y) == CONST.No_Color else CONST.No_Color
+            stones = chains.get_board().compute_changed_stones(x, y)
+            self.assertEqual(sorted(stones), sorted(bitboards.get_board().compute_changed_stones(x, y)))
+            chains = chains.clone()
+            bitboards = bitboards.clone()
+            chains.mark_stones(stones, owner)
+            bitboards.mark_stones(stones, owner)
+            board = chains.get_board()
+            self.assertEqual(position(chains), position(bitboards))
+            self.assertEqual((chains.get_black_territory(), chains.get_white_territory()), (bitboards.get_black_territory(), bitboards.get_white_territory()))
+
+    def test_engines_agree(self):
+        captures = 0
+        for board_size_index in range(len(CONST.Board_Sizes)):
+            for seed in range(3):
+                chains, bitboards, game_captures = self.play_game(board_size_index, seed)
+                forbidden = set([chains.get_previous_position_hash()])
+                for color in (CONST.Black_Color, CONST.White_Color):
+                    self.assertEqual(chains.get_board().compute_legal_moves(color, forbidden), bitboards.get_board().compute_legal_moves(color, forbidden))
+                self.score(chains, bitboards, seed)
+                captures += game_captures
+
+        # Make sure the games got far enough to mean something.
+        self.assertTrue(captures > 0)
+
+    def test_engines_agree_on_ko(self):
+        #   . B W .
+        #   B W . W
+        #   . B W .
+        for engine in (CONST.Chain_Engine, CONST.Bitboard_Engine):
+            state = new_state(2, engine)
+            board = state.get_board()
+            for x, y in ((1, 0), (0, 1), (1, 2)):
+                board.set(x, y, CONST.Black_Color)
+            for x, y in ((2, 0), (1, 1), (3, 1), (2, 2)):
+                board.set(x, y, CONST.White_Color)
+
+            state, move = state.after_move(2, 1, CONST.Black_Color)
+            self.assertEqual(move.captures, [(1, 1)])
+            retake, move = state.after_move(1, 1, CONST.White_Color)
+            self.assertEqual(move.captures, [(2, 1)])
+            self.assertFalse(retake.get_board().is_stone_in_suicide(1, 1))
+            self.assertEqual(retake.get_board().get_position_hash(), state.get_previous_position_hash())
@@ -0,0 +1,62 @@
+from helpers import GoTestCase, go
+
+from google.appengine.ext import db
+
+
+class PlayerLookupTest(GoTestCase):
+    def make_legacy(self, cookie):
+        # Turn a player back into one from before players were keyed by
+        # cookie: same values, numeric id.
+        player = go.Player.get_by_key_name(go.Player.key_name_for(cookie))
+        values = dict((name, prop.get_value_for_datastore(player)) for name, prop in go.Player.properties().items())
+        player.delete()
+        legacy = go.Player(**values)
+        legacy.put()
+        go.ModelCache.clear_cookie(cookie)
+        return legacy
+
+    def test_new_players_are_keyed_by_cookie(self):
+        black, white = self.new_game()
+        player = go.ModelCache.player_by_cookie(black)
+        self.assertEqual(player.key().name(), go.Player.key_name_for(black))
+
+    def test_unknown_cookie(self):
+        self.assertEqual(go.ModelCache.player_by_cookie('nosuchcookie'), None)
+        self.assertEqual(go.ModelCache.players_by_cookies(['nosuchcookie']), {})
+
+    def test_legacy_player_is_found_and_rekeyed(self):
+        black, white = self.new_game()
+        legacy = self.make_legacy(white)
+        self.assertTrue(legacy.key().id() is not None)
+
+        player = go.ModelCache.player_by_cookie(white)
+        self.assertEqual(player.cookie, white)
+        self.assertEqual(player.name, 'bob')
+        self.assertEqual(player.key().name(), go.Player.key_name_for(white))
+        self.assertEqual(db.get(legacy.key()), None)
+
+    def test_legacy_player_in_batch(self):
+        black, white = self.new_game()
+        self.make_legacy(black)
+        players = go.ModelCache.players_by_cookies([black, white, 'nosuchcookie'])
+        self.assertEqual(sorted(players.keys()), sorted([black, white]))
+        self.assertEqual(players[black].key().name(), go.Player.key_name_for(black))
+
+    def test_mapper_rekeys_legacy_players(self):
+        black, white = self.new_game()
+        self.make_legacy(black)
+        self.make_legacy(white)
+        go.KeyPlayersByCookieMapper().run()
+        self.assertEqual(go.Player.all().filter('cookie =', black).get().key().name(), go.Player.key_name_for(black))
+        self.assertEqual(len([player for player in go.Player.all() if player.key().name() is None]), 0)
+
+    def test_unique_pair_skips_legacy_cookies(self):
+        black, white = self.new_game()
+        self.make_legacy(black)
+        cookies = iter([black, 'fresh1', 'fresh2', 'fresh3'])
+        random_cookie = go.GameCookie.__dict__['random_cookie']
+        go.GameCookie.random_cookie = staticmethod(lambda: next(cookies))
+        try:
+            self.assertEqual(go.GameCookie.unique_pair(), ('fresh2', 'fresh3'))
+        finally:
+            go.GameCookie.random_cookie = random_cookie
@@ -0,0 +1,105 @@
+import pickle
+import random
+
+from helpers import GoTestCase, go
+
+from google.appengine.ext import db
+
+CONST = go.CONST
+
+
+def summary(state):
+    board = state.get_board()
+    return (board.get_state_string(), state.get_white_stones_captured(), state.get_black_stones_captured(), state.whose_move, state.get_current_move_number(), state.get_last_move())
+
+
+class ReencodeTest(GoTestCase):
+    def fetch(self, game_key):
+        # A fresh instance, with nothing loaded.
+        return db.get(game_key)
+
+    def play_moves(self, game, count, seed=1):
+        rnd = random.Random(seed)
+        state = game.get_current_state()
+        board = state.get_board()
+        while count:
+            x = rnd.randrange(board.get_width())
+            y = rnd.randrange(board.get_height())
+            if state.get_board().get(x, y) != CONST.No_Color:
+                continue
+            new_state = state.after_move(x, y, state.whose_move)[0]
+            if new_state.get_board().is_stone_in_suicide(x, y):
+                continue
+            game.append_history(game.current_state, state)
+            game.set_current_state(new_state)
+            state = new_state
+            count -= 1
+        game.put()
+
+    def new_game_entity(self):
+        black, white = self.new_game()
+        return self.fetch(go.Player.game.get_value_for_datastore(go.ModelCache.player_by_cookie(black)))
+
+    def assertHistory(self, game_key, expected):
+        game = self.fetch(game_key)
+        self.assertEqual(game.get_history_length(), len(expected))
+        self.assertEqual(len(game.get_history_entries(0, game.get_history_length())), len(expected))
+        self.assertEqual([summary(state) for state in game.get_history_states()], expected)
+        game = self.fetch(game_key)
+        self.assertEqual([summary(game.get_history_state(n)) for n in range(len(expected))], expected)
+
+    def test_reencode_legacy_history(self):
+        game = self.new_game_entity()
+        self.play_moves(game, 40)
+        game = self.fetch(game.key())
+        states = game.get_history_states()
+
+        # Back to how older games stored history: pickles, inline.
+        db.delete(list(go.HistoryChunk.all(keys_only=True).ancestor(game)) + list(go.BoardPayload.all(keys_only=True).ancestor(game)))
+        game.history = [db.Blob(pickle.dumps(state, 2)) for state in states]
+        game.history_count = None
+        db.Model.put(game)
+
+        # One more move moves the history to chunks: pickles, then a keyframe.
+        game = self.fetch(game.key())
+        self.play_moves(game, 1, seed=2)
+        game = self.fetch(game.key())
+        expected = [summary(state) for state in game.get_history_states()]
+        self.assertEqual(len(expected), 41)
+        self.assertEqual(expected[:40], [summary(state) for state in states])
+
+        go.ReencodeGamesMapper().run()
+        game = self.fetch(game.key())
+        for entry in game.get_history_entries(0, game.get_history_length()):
+            self.assertFalse(entry.startswith(pickle.PROTO))
+        self.assertHistory(game.key(), expected)
+
+    def test_reencode_codec_keyframes(self):
+        # Keyframes stored as whole codec states, as they were before boards
+        # were stored separately; they fall on chunk boundaries.
+        game = self.new_game_entity()
+        self.play_moves(game, 40)
+        game = self.fetch(game.key())
+        states = game.get_history_states()
+        expected = [summary(state) for state in states]
+        db.delete(list(go.BoardPayload.all(keys_only=True).ancestor(game)))
+        chunks = list(go.HistoryChunk.all().ancestor(game))
+        keyframes = 0
+        for chunk in chunks:
+            offset = int(chunk.key().name()[len("chunk"):]) * CONST.History_Chunk_Size
+            for i, entry in enumerate(chunk.entries):
+                if go.decode_board_reference(entry) is not None:
+                    chunk.entries[i] = db.Blob(go.dumps_game_state(states[offset + i]))
+                    keyframes += 1
+        db.put(chunks)
+        self.assertTrue(keyframes >= 2)
+
+        go.ReencodeGamesMapper().run()
+        game = self.fetch(game.key())
+        entries = game.get_history_entries(0, game.get_history_length())
+        self.assertEqual(len([entry for entry in entries if go.decode_board_reference(entry) is not None]), keyframes)
+        self.assertHistory(game.key(), expected)
+
+        # And again, which changes nothing.
+        go.ReencodeGamesMapper().run()
+        self.assertHistory(game.key(), expected)
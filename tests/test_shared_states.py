@@ -0,0 +1,71 @@
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+def board_snapshot(board):
+    snapshot = dict(board.__dict__)
+    snapshot['board'] = board.board[:]
+    if board._chains is not None:
+        snapshot['parent'] = board._chains.parent[:]
+    return snapshot
+
+
+class SharedStateTest(GoTestCase):
+    def play(self, cookie, x, y):
+        game = go.ModelCache.player_by_cookie(cookie).get_game()
+        params = {'your_cookie': cookie, 'current_move_number': game.get_current_move_number(), 'move_x': x, 'move_y': y}
+        response = self.call(go.MakeThisMoveHandler, params=params)
+        self.assertTrue('"success": true' in response.body)
+
+    def current_state(self, cookie):
+        return go.ModelCache.player_by_cookie(cookie).get_game().get_current_state()
+
+    def test_cached_states_are_prepared(self):
+        black, white = self.new_game()
+        self.play(black, 3, 3)
+        go.GameStateCache._cache.clear()
+        board = self.current_state(white).get_board()
+        self.assertTrue(board._position_hash is not None)
+        self.assertTrue(board._state_string is not None)
+        self.assertTrue(board._chains is not None or board._bit_planes is not None)
+
+    def test_legal_moves_leaves_the_cached_state(self):
+        black, white = self.new_game()
+        self.play(black, 3, 3)
+        self.play(white, 3, 4)
+        self.play(black, 4, 4)
+        go.GameStateCache._cache.clear()
+        state = self.current_state(white)
+        before = board_snapshot(state.get_board())
+
+        response = self.call(go.LegalMovesHandler, params={'your_cookie': white})
+        self.assertTrue('"success": true' in response.body)
+        self.assertTrue(self.current_state(white) is state)
+        self.assertEqual(board_snapshot(state.get_board()), before)
+
+    def test_legal_moves_on_a_shared_bitboard_board(self):
+        #   . B W .
+        #   B . B W      White to move; retaking at (1, 1) is Ko.
+        #   . B W .
+        masks = []
+        for engine in (CONST.Bitboard_Engine, CONST.Chain_Engine):
+            board = go.GameBoard(2)
+            board.use_engine(engine)
+            for x, y in ((1, 0), (0, 1), (1, 2)):
+                board.set(x, y, CONST.Black_Color)
+            for x, y in ((2, 0), (1, 1), (3, 1), (2, 2)):
+                board.set(x, y, CONST.White_Color)
+            ko_hash = board.get_position_hash()
+            board.play(2, 1, CONST.Black_Color)
+            board.prepare_to_share()
+            before = board_snapshot(board)
+
+            mask = board.compute_legal_moves(CONST.White_Color, set([ko_hash]))
+            self.assertEqual(board_snapshot(board), before)
+            masks.append(mask)
+
+        self.assertEqual(masks[0], masks[1])
+        offsets = board.geometry().offsets
+        self.assertEqual(masks[0][offsets[board.geometry().index(1, 1)]], "0")
+        self.assertEqual(masks[0][offsets[board.geometry().index(5, 5)]], "1")
@@ -0,0 +1,24 @@
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+class SuperkoTest(GoTestCase):
+    def new_superko_game(self):
+        cookie, your_turn = go.CreateGameHandler().create_game('alice', 'alice@example.com', CONST.Email_Contact, 'bob', 'bob@example.com', CONST.Email_Contact, CONST.Black_Color, 2, 0, 0, superko=True)
+        return go.ModelCache.player_by_cookie(cookie).get_game()
+
+    def test_seen_positions(self):
+        game = self.new_superko_game()
+        self.assertFalse(game.has_seen_position(12345))
+        game.remember_position(12345)
+        game.remember_position(12345)
+        self.assertTrue(game.has_seen_position(12345))
+        self.assertEqual(game.position_hashes.count(12345), 1)
+        self.assertTrue(12345 in game.get_forbidden_position_hashes(game.get_current_state()))
+
+        # A fresh instance builds its set from the stored list.
+        game.put()
+        game = go.Game.get(game.key())
+        self.assertTrue(game.has_seen_position(12345))
+        self.assertFalse(game.has_seen_position(54321))
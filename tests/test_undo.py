@@ -0,0 +1,68 @@
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+class UndoTest(GoTestCase):
+    def snapshot(self, board):
+        return (board.board[:], board.get_state_string(), board.get_position_hash())
+
+    def assertUndoes(self, board, x, y, color):
+        before = self.snapshot(board)
+        move = board.play(x, y, color)
+        self.assertEqual(board.get(x, y), color)
+        board.undo(move)
+        self.assertEqual(self.snapshot(board), before)
+        return move
+
+    def test_play_and_undo(self):
+        for engine in (CONST.Chain_Engine, CONST.Bitboard_Engine):
+            board = go.GameBoard(2)
+            board.use_engine(engine)
+            board.set(3, 3, CONST.Black_Color)
+            board.set(3, 4, CONST.Black_Color)
+            self.assertUndoes(board, 3, 5, CONST.Black_Color)
+            self.assertUndoes(board, 0, 0, CONST.White_Color)
+
+    def test_undo_restores_captures(self):
+        for engine in (CONST.Chain_Engine, CONST.Bitboard_Engine):
+            board = go.GameBoard(2)
+            board.use_engine(engine)
+            # A white pair on the edge with one liberty left, at (2, 0).
+            for x, y in ((0, 0), (1, 0)):
+                board.set(x, y, CONST.White_Color)
+            for x, y in ((0, 1), (1, 1)):
+                board.set(x, y, CONST.Black_Color)
+            move = self.assertUndoes(board, 2, 0, CONST.Black_Color)
+            self.assertEqual(sorted(move.captures), [(0, 0), (1, 0)])
+
+            # And the board still plays correctly afterwards.
+            move = board.play(2, 0, CONST.Black_Color)
+            self.assertEqual(board.get(0, 0), CONST.No_Color)
+            self.assertFalse(board.is_stone_in_suicide(2, 0))
+
+    def test_undo_on_a_clone_leaves_the_original(self):
+        board = go.GameBoard(2)
+        board.set(3, 3, CONST.Black_Color)
+        before = self.snapshot(board)
+        clone = board.clone()
+        clone.undo(clone.play(4, 4, CONST.White_Color))
+        self.assertEqual(self.snapshot(board), before)
+        self.assertEqual(self.snapshot(clone), before)
+
+    def test_state_undo_restores_capture_counts(self):
+        state = go.GameState()
+        state.set_board(go.GameBoard(2))
+        board = state.get_board()
+        for x, y in ((0, 0), (1, 0)):
+            board.set(x, y, CONST.White_Color)
+        for x, y in ((0, 1), (1, 1)):
+            board.set(x, y, CONST.Black_Color)
+        state.set_black_stones_captured(3)
+        before = self.snapshot(board)
+
+        move = state.play(2, 0, CONST.Black_Color)
+        self.assertEqual((state.get_white_stones_captured(), state.get_black_stones_captured()), (2, 3))
+        state.undo(move)
+        self.assertEqual((state.get_white_stones_captured(), state.get_black_stones_captured()), (0, 3))
+        self.assertEqual(self.snapshot(board), before)
@@ -0,0 +1,51 @@
+from helpers import GoTestCase, go
+
+from google.appengine.api import memcache
+
+
+class UnknownCookieTest(GoTestCase):
+    def has_opponent_moved(self, cookie, ip='1.2.3.4'):
+        return self.call(go.HasOpponentMovedHandler, params={'your_cookie': cookie, 'current_move_number': 0}, ip=ip)
+
+    def test_unknown_cookie_is_cached(self):
+        self.assertEqual(go.ModelCache.player_by_cookie('nosuchcookie'), None)
+        self.assertEqual(memcache.get('player:nosuchcookie'), False)
+
+    def test_unknown_cookie_is_cached_by_batch(self):
+        self.assertEqual(go.ModelCache.players_by_cookies(['nosuchcookie']), {})
+        self.assertEqual(memcache.get('player:nosuchcookie'), False)
+        go.ModelCache._players.clear()
+        self.assertEqual(go.ModelCache.players_by_cookies(['nosuchcookie']), {})
+
+    def test_unknown_cookie_fails_cleanly(self):
+        response = self.has_opponent_moved('nosuchcookie')
+        self.assertTrue('"success": false' in response.body)
+
+    def test_limiter_spends_on_unknown_cookies(self):
+        for i in range(go.CONST.Unknown_Cookie_IP_Burst):
+            self.has_opponent_moved('probe%d' % i, ip='9.9.9.9')
+        limiter = go.CookieLimiter('9.9.9.9', 'another')
+        self.assertFalse(limiter.allow())
+        self.assertTrue(go.CookieLimiter('8.8.8.8', 'another').allow())
+
+    def test_new_game_forgets_unknown_cookie(self):
+        memcache.set('player:fresh1', False)
+        unique_pair = go.GameCookie.__dict__['unique_pair']
+        go.GameCookie.unique_pair = staticmethod(lambda: ('fresh1', 'fresh2'))
+        try:
+            self.new_game()
+        finally:
+            go.GameCookie.unique_pair = unique_pair
+        self.assertEqual(go.ModelCache.player_by_cookie('fresh1').cookie, 'fresh1')
+
+    def test_drained_limiter_still_finds_players(self):
+        black, white = self.new_game()
+        for i in range(go.CONST.Unknown_Cookie_IP_Burst):
+            self.has_opponent_moved('probe%d' % i, ip='9.9.9.9')
+        go.ModelCache.clear_cookie(black)
+        self.assertTrue('"success": true' in self.has_opponent_moved(black, ip='9.9.9.9').body)
+
+        # Without the search for older players, a miss isn't cached.
+        self.assertFalse(go.CookieLimiter('9.9.9.9', 'another').allow())
+        self.assertEqual(go.ModelCache.player_by_cookie('another', go.CookieLimiter('9.9.9.9', 'another')), None)
+        self.assertEqual(memcache.get('player:another'), None)
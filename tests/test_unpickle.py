@@ -0,0 +1,70 @@
+import pickle
+import random
+import threading
+
+from helpers import GoTestCase, go
+
+CONST = go.CONST
+
+
+def summary(state):
+    board = state.get_board()
+    return (board.get_state_string(), board.get_position_hash(), board.get_komi_index(), state.get_white_stones_captured(), state.get_black_stones_captured(), state.whose_move, state.get_current_move_number(), state.get_scoring_number())
+
+
+def legacy_pickle(state):
+    # The way states were stored before the python2.7 API: protocol 0,
+    # with the classes in __main__.
+    return pickle.dumps(state, 0).replace("c%s\n" % go.__name__, "c__main__\n")
+
+
+class LegacyUnpickleTest(GoTestCase):
+    def legacy_blobs(self):
+        rnd = random.Random(CONST.Zobrist_Seed)
+        states = []
+        for board_size_index in range(len(CONST.Board_Sizes)):
+            state = go.GameState()
+            state.set_board(go.GameBoard(board_size_index, komi_index=1))
+            state.set_whose_move(CONST.Black_Color)
+            for i in range(60):
+                x = rnd.randrange(state.get_board().get_width())
+                y = rnd.randrange(state.get_board().get_height())
+                if state.get_board().get(x, y) == CONST.No_Color:
+                    new_state = state.after_move(x, y, state.whose_move)[0]
+                    if not new_state.get_board().is_stone_in_suicide(x, y):
+                        state = new_state
+            states.append(state)
+
+            # Scoring, so the board has owners too.
+            states.append(state.after_pass(state.whose_move).after_pass(go.opposite_color(state.whose_move)))
+
+        blobs = [(legacy_pickle(state), summary(state)) for state in states]
+
+        # Boards stored as lists of columns, from before flat arrays.
+        state = states[0].clone()
+        board = state.get_board()
+        board.board = board.geometry().to_lists(board.board)
+        blobs.append((legacy_pickle(state), summary(states[0])))
+        return blobs
+
+    def test_threaded_safe_pickle_loads(self):
+        blobs, expected = zip(*self.legacy_blobs())
+        self.assertEqual(tuple([summary(go._PythonLegacyUnpickler(go.StringIO(blob)).load()) for blob in blobs]), expected)
+
+        results = []
+        def decode():
+            for i in range(20):
+                for index, blob in enumerate(blobs):
+                    try:
+                        results.append((index, summary(go.safe_pickle_loads(blob))))
+                    except Exception, e:
+                        results.append((index, e))
+        threads = [threading.Thread(target=decode) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4 * 20 * len(blobs))
+        for index, result in results:
+            self.assertEqual(result, expected[index])
@@ -18,24 +18,32 @@
 # This file is the appengine back-end to the Go application.
 #------
 
+import array
 import cgi
+import cPickle
+import hashlib
 import os
 import sys
 import logging
-import copy
 import pickle
 import random
 import string
+import struct
+import threading
+import time
 import traceback
 import webapp2
+import zlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import simplejson
-from StringIO import StringIO
+from cStringIO import StringIO
 
 from google.appengine.ext.webapp import template
 from google.appengine.ext import db
 from google.appengine.api import memcache
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
 
 import urllib
 import urllib2
@@ -53,6 +61,10 @@ class CONST(object):
     White_Color = 2
     Both_Colors = 3
     Color_Names = ['none', 'black', 'white', 'both']
+
+    # The state string character for a point, indexed by (piece * 4) + owner:
+    # B/W is territory, b/w a live stone, c/x a dead black/white stone.
+    State_Chars = ".BW.bbcbwxww"
     Star_Ordinals = [[3, 9, 15], [3, 6, 9], [2, 4, 6]]
     Board_Sizes = [(19, 19), (13, 13), (9, 9)]
     Board_Classes = ['nineteen_board', 'thirteen_board', 'nine_board']
@@ -66,6 +78,64 @@ class CONST(object):
     Komis = [6.5, 5.5, 0.5, -4.5, -5.5]
     Komi_Names = ['has six komi', 'has five komi', 'has no komi', 'has five reverse komi', 'has six reverse komi']
     Komi_None = 2
+    Zobrist_Seed = 20090419
+
+    # Game.history stores just the action for most states, and the whole
+    # state (a "keyframe") this often or when the action isn't enough.
+    Move_Action = "m"
+    Pass_Action = "p"
+    Resign_Action = "r"
+    History_Keyframe_Interval = 32
+
+    # Keyframes store the state's own fields and the hash of its board; each
+    # distinct board is stored once per game. See Game.encode_keyframe.
+    Board_Reference = "k"
+    History_Board_Cache_Size = 200
+
+    # Finished games untouched for this long are moved into a GameArchive.
+    Archive_Finished_Games_After_Days = 7
+
+    # History lives in child entities of the game, this many entries to an
+    # entity. Keep it a multiple of History_Keyframe_Interval so that every
+    # chunk starts with a keyframe.
+    History_Chunk_Size = 32
+    Off_Board = 4
+
+    # Which engine GameBoard uses for captures and scoring. Both give the same
+    # answers; set GO_BOARD_ENGINE in app.yaml to switch.
+    Chain_Engine = "chains"
+    Bitboard_Engine = "bitboards"
+    Board_Engine = os.environ.get("GO_BOARD_ENGINE", Chain_Engine)
+
+    # How many decoded game states each instance keeps; see GameStateCache.
+    Game_State_Cache_Size = 200
+
+    # See GameCache.
+    Game_Cache_Size = 200
+    Game_Cache_Seconds = 60 * 60
+
+    # How many times a memcache compare-and-set is retried before giving up.
+    Memcache_CAS_Attempts = 3
+
+    # Players each instance keeps, and for how long before asking memcache
+    # again; see ModelCache.
+    Player_Cache_Size = 500
+    Player_Cache_Seconds = 10
+
+    # See CacheLease.
+    Cache_Lease_Seconds = 5
+    Cache_Lease_Polls = 5
+    Cache_Lease_Poll_Seconds = 0.05
+
+    # Unknown cookies: how long memcache remembers one, and how many new
+    # ones a client IP (and each cookie) may have looked up; see
+    # CookieLimiter. Real cookies are six or seven characters.
+    Unknown_Cookie_Seconds = 5 * 60
+    Unknown_Cookie_IP_Burst = 20
+    Unknown_Cookie_IP_Per_Second = 1.0 / 30
+    Unknown_Cookie_Burst = 3
+    Unknown_Cookie_Per_Second = 1.0 / 300
+    Max_Cookie_Length = 64
     Email_Contact = "email"
     Twitter_Contact = "twitter"
     No_Contact = "none"
@@ -154,43 +224,632 @@ _pickle_module_name_map = {
 def _pickle_map_name(name):
     return _pickle_module_name_map.get(name, name)
 
-def _pickle_dispatch_global(self):
-    module = _pickle_map_name(self.readline()[:-1])
-    name = _pickle_map_name(self.readline()[:-1])
-    klass = self.find_class(module, name)
-    self.append(klass)
+def _pickle_find_global(module, name):
+    module = _pickle_map_name(module)
+    __import__(module)
+    return getattr(sys.modules[module], _pickle_map_name(name))
 
 def safe_pickle_loads(s):
-    f = StringIO(s)
-    unpickler = pickle.Unpickler(f)
-    unpickler.dispatch[pickle.GLOBAL] = _pickle_dispatch_global
+    if s.startswith(_State_Codec_Magic):
+        return loads_game_state(s)
+    # Each call gets its own unpickler, so concurrent requests don't share
+    # any state.
+    unpickler = cPickle.Unpickler(StringIO(s))
+    unpickler.find_global = _pickle_find_global
     return unpickler.load()
 
 
 #------------------------------------------------------------------------------
-# Game State
+# Binary GameState codec. After a magic prefix (which no pickle starts with)
+# come the state's fields and then its board's, each as a tagged value, with
+# a bitmask saying which fields are present. Stones and owners are packed
+# four points to a byte. Anything this can't describe is pickled instead.
 #------------------------------------------------------------------------------
 
-import array
-import itertools
-class BoardArray(object):
-    def __init__(self, width=19, height=19, default=0, typecode='i'):
+_State_Codec_Magic = "GoS\x01"
+_Game_Archive_Magic = "GoA\x01"
+
+# Never reorder these; append new fields at the end.
+_State_Fields = ['whose_move', 'current_move_number', 'white_stones_captured', 'black_stones_captured', 'last_move', 'last_move_was_pass', 'last_move_message', 'scoring_number', 'white_territory', 'black_territory', 'white_done_number', 'black_done_number', 'winner', 'previous_position_hash', 'last_action']
+_Board_Fields = ['width', 'height', 'size_index', 'handicap_index', '_version', '_komi_index', '_has_owners', '_position_hash']
+_Board_Planes = ['board', 'owners']
+
+_Tag_None, _Tag_False, _Tag_True, _Tag_Int, _Tag_Negative_Int, _Tag_Float, _Tag_String, _Tag_Unicode, _Tag_Tuple, _Tag_List = range(10)
+
+_Unpacked_Bytes = [(b & 3, (b >> 2) & 3, (b >> 4) & 3, b >> 6) for b in range(256)]
+
+def _encode_varint(n, parts):
+    while n > 0x7f:
+        parts.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    parts.append(chr(n))
+
+def _decode_varint(s, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = ord(s[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _encode_value(value, parts):
+    if value is None:
+        parts.append(chr(_Tag_None))
+    elif value is False:
+        parts.append(chr(_Tag_False))
+    elif value is True:
+        parts.append(chr(_Tag_True))
+    elif isinstance(value, (int, long)):
+        if value >= 0:
+            parts.append(chr(_Tag_Int))
+            _encode_varint(value, parts)
+        else:
+            parts.append(chr(_Tag_Negative_Int))
+            _encode_varint(-value, parts)
+    elif isinstance(value, float):
+        parts.append(chr(_Tag_Float))
+        parts.append(struct.pack("!d", value))
+    elif isinstance(value, str):
+        parts.append(chr(_Tag_String))
+        _encode_varint(len(value), parts)
+        parts.append(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+        parts.append(chr(_Tag_Unicode))
+        _encode_varint(len(value), parts)
+        parts.append(value)
+    elif isinstance(value, (tuple, list)):
+        parts.append(chr(_Tag_Tuple if isinstance(value, tuple) else _Tag_List))
+        _encode_varint(len(value), parts)
+        for item in value:
+            _encode_value(item, parts)
+    else:
+        raise TypeError("Can't encode %r" % (value,))
+
+def _decode_value(s, pos):
+    tag = ord(s[pos])
+    pos += 1
+    if tag == _Tag_None:
+        return None, pos
+    elif tag == _Tag_False:
+        return False, pos
+    elif tag == _Tag_True:
+        return True, pos
+    elif tag == _Tag_Int:
+        return _decode_varint(s, pos)
+    elif tag == _Tag_Negative_Int:
+        value, pos = _decode_varint(s, pos)
+        return -value, pos
+    elif tag == _Tag_Float:
+        return struct.unpack("!d", s[pos:pos + 8])[0], pos + 8
+    elif tag == _Tag_String or tag == _Tag_Unicode:
+        length, pos = _decode_varint(s, pos)
+        value = s[pos:pos + length]
+        if tag == _Tag_Unicode:
+            value = value.decode('utf-8')
+        return value, pos + length
+    elif tag == _Tag_Tuple or tag == _Tag_List:
+        length, pos = _decode_varint(s, pos)
+        items = []
+        for i in range(length):
+            item, pos = _decode_value(s, pos)
+            items.append(item)
+        if tag == _Tag_Tuple:
+            items = tuple(items)
+        return items, pos
+    raise ValueError("Unknown game state codec tag %d" % tag)
+
+def _encode_fields(attributes, fields, parts):
+    mask = 0
+    for i, field in enumerate(fields):
+        if field in attributes:
+            mask |= 1 << i
+    _encode_varint(mask, parts)
+    for field in fields:
+        if field in attributes:
+            _encode_value(attributes[field], parts)
+
+def _decode_fields(s, pos, fields, attributes):
+    mask, pos = _decode_varint(s, pos)
+    for i, field in enumerate(fields):
+        if mask & (1 << i):
+            attributes[field], pos = _decode_value(s, pos)
+    return pos
+
+def _pack_plane(cells, geometry):
+    values = [cells[p] for p in geometry.points] + [0, 0, 0]
+    if max(values) > 3 or min(values) < 0:
+        raise ValueError("Can't pack board values")
+    return "".join([chr(values[i] | (values[i + 1] << 2) | (values[i + 2] << 4) | (values[i + 3] << 6)) for i in range(0, len(geometry.points), 4)])
+
+def _unpack_plane(s, pos, geometry):
+    length = (len(geometry.points) + 3) // 4
+    values = []
+    for c in s[pos:pos + length]:
+        values.extend(_Unpacked_Bytes[ord(c)])
+    cells = array.array('b', [CONST.Off_Board]) * geometry.size
+    width = geometry.width
+    for y in range(geometry.height):
+        start = geometry.index(0, y)
+        cells[start:start + width] = array.array('b', values[y * width:(y + 1) * width])
+    return cells, pos + length
+
+def _encode_board(board, parts):
+    board_attributes = board.__getstate__()
+    if set(board_attributes) - set(_Board_Fields) - set(_Board_Planes) or 'board' not in board_attributes:
+        raise ValueError("Can't encode board attributes")
+    _encode_fields(board_attributes, _Board_Fields, parts)
+    geometry = board.geometry()
+    owners = board_attributes.get('owners')
+    parts.append(chr(0 if owners is None else 1))
+    parts.append(_pack_plane(board.board, geometry))
+    if owners is not None:
+        parts.append(_pack_plane(owners, geometry))
+
+def _decode_board(s, pos):
+    board_attributes = {}
+    pos = _decode_fields(s, pos, _Board_Fields, board_attributes)
+    geometry = board_geometry(board_attributes['width'], board_attributes['height'])
+    has_owners = s[pos] != chr(0)
+    board_attributes['board'], pos = _unpack_plane(s, pos + 1, geometry)
+    if has_owners:
+        board_attributes['owners'], pos = _unpack_plane(s, pos, geometry)
+    board = GameBoard.__new__(GameBoard)
+    board.__setstate__(board_attributes)
+    return board, pos
+
+def _make_game_state(attributes):
+    state = GameState.__new__(GameState)
+    state.__setstate__(attributes)
+    return state
+
+def split_game_state(state):
+    # The state's own fields and its board, encoded separately, or None if
+    # the codec can't describe them.
+    board = state.get_board()
+    if board is None or set(state.__dict__) - set(_State_Fields) != set(['board']):
+        return None
+    state_parts = []
+    board_parts = []
+    try:
+        _encode_fields(state.__dict__, _State_Fields, state_parts)
+        _encode_board(board, board_parts)
+    except (TypeError, ValueError):
+        return None
+    return "".join(state_parts), "".join(board_parts)
+
+def join_game_state(state_fields, board):
+    # Undoes split_game_state, given the decoded board.
+    attributes = {}
+    _decode_fields(state_fields, 0, _State_Fields, attributes)
+    attributes['board'] = board
+    return _make_game_state(attributes)
+
+def loads_game_board(s):
+    return _decode_board(s, 0)[0]
+
+def dumps_game_state(state):
+    split = split_game_state(state)
+    if split is None:
+        return pickle.dumps(state, 2)
+    return _State_Codec_Magic + split[0] + split[1]
+
+def loads_game_state(s):
+    attributes = {}
+    pos = _decode_fields(s, len(_State_Codec_Magic), _State_Fields, attributes)
+    attributes['board'], pos = _decode_board(s, pos)
+    return _make_game_state(attributes)
+
+
+#------------------------------------------------------------------------------
+# Zobrist hashing: a board position is the xor of one random key per stone
+#------------------------------------------------------------------------------
+
+_zobrist_tables = {}
+
+def zobrist_table(width, height):
+    # Indexed [x * height + y][color]. Hashes are stored with games, so the
+    # keys come from a fixed seed and must never change; 63 bits keeps every
+    # hash inside a datastore integer.
+    table = _zobrist_tables.get((width, height))
+    if table is None:
+        rng = random.Random(CONST.Zobrist_Seed + (width * 100) + height)
+        table = [(0, rng.getrandbits(63), rng.getrandbits(63)) for p in range(width * height)]
+        _zobrist_tables[(width, height)] = table
+    return table
+
+
+#------------------------------------------------------------------------------
+# Board geometry: boards are flat arrays with a one point border of
+# CONST.Off_Board all the way around, so neighbours never need bounds checks.
+#------------------------------------------------------------------------------
+
+class BoardGeometry(object):
+    def __init__(self, width, height):
+        super(BoardGeometry, self).__init__()
         self.width = width
         self.height = height
-        self.board = array.array(typecode, itertools.repeat(default, width * height))
+        self.stride = width + 2
+        self.size = self.stride * (height + 2)
+
+        # On-board points, row by row (the order of the state string.)
+        self.points = [self.index(x, y) for y in range(height) for x in range(width)]
+
+        self.coords = [None] * self.size
+        self.offsets = [None] * self.size
+        self.neighbours = [()] * self.size
+        self.border = bytearray([1]) * self.size
+        for p in self.points:
+            self.coords[p] = ((p % self.stride) - 1, (p // self.stride) - 1)
+            # Left, top, right, bottom; some of these may be on the border.
+            self.neighbours[p] = (p - 1, p - self.stride, p + 1, p + self.stride)
+            self.border[p] = 0
+        for offset, p in enumerate(self.points):
+            self.offsets[p] = offset
+
+        # Bit p is set for every on-board point p; see BitPlanes.
+        self.on_board_mask = 0
+        for p in self.points:
+            self.on_board_mask |= 1 << p
+
+        # The same keys as zobrist_table, renumbered.
+        table = zobrist_table(width, height)
+        self.zobrist = [(0, 0, 0)] * self.size
+        for p in self.points:
+            x, y = self.coords[p]
+            self.zobrist[p] = table[x * height + y]
 
     def index(self, x, y):
-        assert (0 <= x) and (x < self.width)
-        assert (0 <= y) and (y < self.height)
-        return y * self.height + x
+        return ((y + 1) * self.stride) + x + 1
 
-    def get(self, x, y):
-        return self.board[self.index(x, y)]
+    def make_array(self, value):
+        cells = array.array('b', [CONST.Off_Board]) * self.size
+        for p in self.points:
+            cells[p] = value
+        return cells
+
+    def from_lists(self, lists):
+        # Boards pickled before the flat layout were lists of columns, [x][y].
+        cells = self.make_array(CONST.No_Color)
+        for x in range(self.width):
+            for y in range(self.height):
+                cells[self.index(x, y)] = lists[x][y]
+        return cells
+
+    def to_lists(self, cells):
+        return [[cells[self.index(x, y)] for y in range(self.height)] for x in range(self.width)]
+
+_board_geometries = {}
+for _width, _height in CONST.Board_Sizes:
+    _board_geometries[(_width, _height)] = BoardGeometry(_width, _height)
+
+def board_geometry(width, height):
+    return _board_geometries[(width, height)]
+
+
+#------------------------------------------------------------------------------
+# Chains: connected stones and their liberties, kept up to date as stones
+# are placed so that captures, ataris and suicide checks don't flood-fill.
+#------------------------------------------------------------------------------
+
+class Chain(object):
+    __slots__ = ('color', 'stones', 'liberties')
+
+    def __init__(self, color):
+        self.color = color
+        self.stones = []
+        self.liberties = set()
+
+class ChainTracker(object):
+    # Union-find over board points. Every stone points (eventually) at the
+    # root of its chain; only roots have an entry in self.chains. Empty and
+    # off-board points have no parent. Union by size keeps the trees shallow
+    # enough that find doesn't compress paths, so reading a tracker (which
+    # clones share; see GameBoard.clone) never changes it.
+
+    def __init__(self, board):
+        super(ChainTracker, self).__init__()
+        self.board = board.board
+        self.geometry = board.geometry()
+        self.parent = [-1] * self.geometry.size
+        self.chains = {}
+        self._build()
+
+    def _build(self):
+        cells = self.board
+        for p in self.geometry.points:
+            if cells[p] != CONST.No_Color:
+                self.place(p, cells[p])
+
+    def find(self, p):
+        parent = self.parent
+        if parent[p] == -1:
+            return -1
+        while parent[p] != p:
+            p = parent[p]
+        return p
+
+    def chain_at(self, p):
+        root = self.find(p)
+        if root == -1:
+            return None
+        return self.chains[root]
+
+    def _union(self, a, b):
+        # Merge the chains rooted at a and b; the larger chain absorbs the smaller.
+        if a == b:
+            return a
+        chain_a = self.chains[a]
+        chain_b = self.chains[b]
+        if len(chain_a.stones) < len(chain_b.stones):
+            a, b = b, a
+            chain_a, chain_b = chain_b, chain_a
+        self.parent[b] = a
+        chain_a.stones.extend(chain_b.stones)
+        chain_a.liberties |= chain_b.liberties
+        del self.chains[b]
+        return a
+
+    def place(self, p, color):
+        # Called after an empty point receives a stone.
+        cells = self.board
+        chain = Chain(color)
+        chain.stones.append(p)
+        self.parent[p] = p
+        self.chains[p] = chain
+
+        root = p
+        for n in self.geometry.neighbours[p]:
+            if cells[n] == CONST.No_Color:
+                self.chains[root].liberties.add(n)
+                continue
+            neighbour_root = self.find(n)
+            if neighbour_root == -1:
+                # Off the board, or not placed yet while building (it will find us.)
+                continue
+            self.chains[neighbour_root].liberties.discard(p)
+            if cells[n] == color:
+                root = self._union(root, neighbour_root)
+
+    def remove_chain(self, chain):
+        # Called after every stone in the chain has been cleared from the board.
+        # Each cleared point becomes a liberty of the chains that border it.
+        root = self.find(chain.stones[0])
+        del self.chains[root]
+        for p in chain.stones:
+            self.parent[p] = -1
+        for p in chain.stones:
+            for n in self.geometry.neighbours[p]:
+                neighbour_root = self.find(n)
+                if neighbour_root != -1:
+                    self.chains[neighbour_root].liberties.add(p)
+
+    def clone(self, board):
+        # For a board that has just copied the cells this tracker was built
+        # on; see GameBoard._own_arrays.
+        clone = ChainTracker.__new__(ChainTracker)
+        clone.board = board.board
+        clone.geometry = self.geometry
+        clone.parent = self.parent[:]
+        clone.chains = {}
+        for root, chain in self.chains.iteritems():
+            copy = Chain(chain.color)
+            copy.stones = chain.stones[:]
+            copy.liberties = set(chain.liberties)
+            clone.chains[root] = copy
+        return clone
+
+
+
+#------------------------------------------------------------------------------
+# Bitboards: the alternative engine. Stones and owners are kept as Python
+# integers with bit p set for point p, so flood fills are shift/and/or loops.
+#------------------------------------------------------------------------------
+
+def _bit_count(mask):
+    return bin(mask).count("1")
+
+def _bit_points(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class BitPlanes(object):
+    # Derived from a GameBoard's cells and owners; never pickled.
+
+    def __init__(self, board):
+        super(BitPlanes, self).__init__()
+        self.geometry = board.geometry()
+        self.stride = self.geometry.stride
+        self.on_board = self.geometry.on_board_mask
+
+        # Both indexed by color; index 0 is unused.
+        self.stones = [0, 0, 0]
+        self.owned = [0, 0, 0]
+
+        cells = board.board
+        owners = board._owner_cells()
+        for p in self.geometry.points:
+            if cells[p] != CONST.No_Color:
+                self.stones[cells[p]] |= 1 << p
+            if owners is not None and owners[p] != CONST.No_Color:
+                self.owned[owners[p]] |= 1 << p
+
+    def clone(self):
+        clone = BitPlanes.__new__(BitPlanes)
+        clone.__dict__.update(self.__dict__)
+        clone.stones = list(self.stones)
+        clone.owned = list(self.owned)
+        return clone
+
+    def set_stone(self, p, old_color, color):
+        bit = 1 << p
+        if old_color != CONST.No_Color:
+            self.stones[old_color] &= ~bit
+        if color != CONST.No_Color:
+            self.stones[color] |= bit
+
+    def set_owner(self, p, color):
+        bit = 1 << p
+        self.owned[CONST.Black_Color] &= ~bit
+        self.owned[CONST.White_Color] &= ~bit
+        if color != CONST.No_Color:
+            self.owned[color] |= bit
+
+    def clear_owners(self):
+        self.owned = [0, 0, 0]
+
+    def _dilate(self, mask):
+        # The mask plus all of its neighbours; the border bits fall off.
+        s = self.stride
+        return (mask | (mask << 1) | (mask >> 1) | (mask << s) | (mask >> s)) & self.on_board
+
+    def _flood(self, seed, within):
+        region = seed
+        while True:
+            grown = self._dilate(region) & within
+            if grown == region:
+                return region
+            region = grown
+
+    def _empty(self):
+        return self.on_board & ~(self.stones[CONST.Black_Color] | self.stones[CONST.White_Color])
+
+    def compute_atari_and_captures(self, p):
+        color = CONST.No_Color
+        for candidate in (CONST.Black_Color, CONST.White_Color):
+            if self.stones[candidate] & (1 << p):
+                color = candidate
+        if color == CONST.No_Color:
+            return (0, [])
+        other_stones = self.stones[opposite_color(color)]
+        empty = self._empty()
+
+        ataris = 0
+        groups = []
+        captured = []
+        for n in self.geometry.neighbours[p]:
+            bit = 1 << n
+            if not (other_stones & bit):
+                continue
+            for group, liberties in groups:
+                if group & bit:
+                    break
+            else:
+                group = self._flood(bit, other_stones)
+                liberties = _bit_count(self._dilate(group) & empty)
+                groups.append((group, liberties))
+            if liberties == 1:
+                ataris += 1
+            if liberties == 0 and group not in captured:
+                captured.append(group)
 
-    def set(self, x, y, value):
-        self.board[self.index(x, y)] = value
+        coords = self.geometry.coords
+        final_captures = []
+        for group in captured:
+            final_captures.extend(sorted(coords[q] for q in _bit_points(group)))
+        return (ataris, final_captures)
+
+    def groups(self):
+        # {point: (group, liberty count)} for every stone on the board, with
+        # each group as its mask.
+        empty = self._empty()
+        groups = {}
+        for color in (CONST.Black_Color, CONST.White_Color):
+            remaining = self.stones[color]
+            while remaining:
+                group = self._flood(remaining & -remaining, self.stones[color])
+                liberties = _bit_count(self._dilate(group) & empty)
+                for q in _bit_points(group):
+                    groups[q] = (group, liberties)
+                remaining &= ~group
+        return groups
+
+    def liberty_count(self, p):
+        # Liberties of the group at p, or None if p is empty.
+        bit = 1 << p
+        for color in (CONST.Black_Color, CONST.White_Color):
+            if self.stones[color] & bit:
+                group = self._flood(bit, self.stones[color])
+                return _bit_count(self._dilate(group) & self._empty())
+        return None
+
+    def mark_territory(self, board):
+        stones = self.stones[CONST.Black_Color] | self.stones[CONST.White_Color]
+        owned = self.owned[CONST.Black_Color] | self.owned[CONST.White_Color]
+        live = stones & ~owned
+        if (stones & owned) and not live:
+            # It doesn't make sense that every stone is dead.  Resurrect all of
+            # them.
+            board.make_owners()
+            live = stones
+
+        live_black = live & self.stones[CONST.Black_Color]
+        live_white = live & self.stones[CONST.White_Color]
+        free = self.on_board & ~live
+
+        # Each connected region of empty points and dead stones belongs to
+        # whoever's live stones (alone) surround it.
+        owned = [0, 0, 0]
+        remaining = free
+        while remaining:
+            region = self._flood(remaining & -remaining, free)
+            remaining &= ~region
+            edge = self._dilate(region)
+            if (edge & live_black) and not (edge & live_white):
+                owned[CONST.Black_Color] |= region
+            elif (edge & live_white) and not (edge & live_black):
+                owned[CONST.White_Color] |= region
+
+        # A stone can't be in its own color's territory.
+        owned[CONST.Black_Color] &= ~self.stones[CONST.Black_Color]
+        owned[CONST.White_Color] &= ~self.stones[CONST.White_Color]
+
+        if free and not board.has_owners():
+            board.make_owners()
+        owners = board.owners
+        for p in _bit_points(free):
+            if owned[CONST.Black_Color] & (1 << p):
+                owners[p] = CONST.Black_Color
+            elif owned[CONST.White_Color] & (1 << p):
+                owners[p] = CONST.White_Color
+            else:
+                owners[p] = CONST.No_Color
+        self.owned = owned
+
+    def count_territory(self, color, captures=0):
+        owned = self.owned[color]
+        return captures + _bit_count(owned) + _bit_count(owned & self.stones[opposite_color(color)])
+
+
+#------------------------------------------------------------------------------
+# Game State
+#------------------------------------------------------------------------------
+
+class UndoRecord(object):
+    # Everything GameBoard.undo (and GameState.undo) needs to take back a
+    # move made with play.
+    def __init__(self, x, y, color, position_hash):
+        super(UndoRecord, self).__init__()
+        self.x = x
+        self.y = y
+        self.color = color
+        self.position_hash = position_hash
+        self.ataris = 0
+        self.captures = []
+
+        # Filled in by GameState.play.
+        self.white_stones_captured = None
+        self.black_stones_captured = None
 
 class GameBoard(object):
+    # Guards _copy_on_write; see clone.
+    _clone_lock = threading.Lock()
+
     def __init__(self, board_size_index=0, handicap_index=0, komi_index=0):
         super(GameBoard, self).__init__()
         self.width = CONST.Board_Sizes[board_size_index][0]
@@ -207,10 +866,61 @@ class GameBoard(object):
         # v3: access via has_owners.
         self._has_owners = False
 
+        # Derived from the board, never pickled; see _get_chains and
+        # _get_bit_planes. Only the engine in use ever builds its own.
+        self._engine = CONST.Board_Engine
+        self._chains = None
+        self._bit_planes = None
+
+        # Pickled, but computed on demand for old boards; see get_position_hash.
+        self._position_hash = None
+
+        # Never pickled; see get_state_string.
+        self._state_buffer = None
+        self._state_string = None
+
+        # Never pickled; see clone.
+        self._copy_on_write = False
+
         self._make_board()
         self._apply_handicap()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_engine', None)
+        state.pop('_chains', None)
+        state.pop('_bit_planes', None)
+        state.pop('_state_buffer', None)
+        state.pop('_state_string', None)
+        state.pop('_copy_on_write', None)
+        return state
+
+    def __setstate__(self, state):
+        # Old pickles don't know about chains or hashes; both get rebuilt on demand.
+        self._position_hash = None
+        self.__dict__.update(state)
+        self._engine = CONST.Board_Engine
+        self._chains = None
+        self._bit_planes = None
+        self._state_buffer = None
+        self._state_string = None
+        self._copy_on_write = False
+
+        # Old pickles also store lists of columns rather than flat arrays.
+        if isinstance(self.board, list):
+            self.board = self.geometry().from_lists(self.board)
+        if isinstance(getattr(self, 'owners', None), list):
+            self.owners = self.geometry().from_lists(self.owners)
+
+        # Fill in what older versions lack, so the getters needn't check.
+        # _version itself stays as it was: handicap placement depends on it.
+        self.__dict__.setdefault('_version', 0)
+        self.__dict__.setdefault('_has_owners', False)
+        if self._version < 2:
+            self._komi_index = CONST.Komi_None if self.handicap_index else 0
+
     def to_jsonable(self):
+        geometry = self.geometry()
         return {
             "width": self.width,
             "height": self.height,
@@ -219,20 +929,53 @@ class GameBoard(object):
             "komi_index": self.get_komi_index(),
             "version": self.get_version(),
             "has_owners": self.has_owners(),
-            "board": self.board,
-            "owners": self.owners if self.has_owners() else None,
+            "board": geometry.to_lists(self.board),
+            "owners": geometry.to_lists(self.owners) if self.has_owners() else None,
         }
 
+    def geometry(self):
+        return board_geometry(self.width, self.height)
+
+    def use_engine(self, engine):
+        self._engine = engine
+        self._chains = None
+        self._bit_planes = None
+
+    def _uses_bit_planes(self):
+        return self._engine == CONST.Bitboard_Engine
+
+    def _get_bit_planes(self):
+        if self._bit_planes is None:
+            self._bit_planes = BitPlanes(self)
+        return self._bit_planes
+
+    def _own_arrays(self):
+        # Called before any write: a clone shares its arrays, state string
+        # buffer and chains with the board it came from until one of them
+        # changes.
+        if not self._copy_on_write:
+            return
+        with GameBoard._clone_lock:
+            shared = self._copy_on_write
+            self._copy_on_write = False
+        if shared:
+            self.board = self.board[:]
+            if getattr(self, 'owners', None) is not None:
+                self.owners = self.owners[:]
+            if self._state_buffer is not None:
+                self._state_buffer = bytearray(self._state_buffer)
+            if self._chains is not None:
+                self._chains = self._chains.clone(self)
+
     def _make_board(self):
-        self.board = []
-        for x in range(self.width):
-            self.board.append([CONST.No_Color] * self.height)
+        self.board = self.geometry().make_array(CONST.No_Color)
 
     def make_owners(self):
-        self.owners = []
-        for x in range(self.width):
-            self.owners.append([CONST.No_Color] * self.height)
+        self.owners = self.geometry().make_array(CONST.No_Color)
         self._has_owners = True
+        if self._bit_planes is not None:
+            self._bit_planes.clear_owners()
+        self._forget_state_string()
 
     def _apply_handicap(self):
         positions_handicap = self.get_handicap_positions()
@@ -241,23 +984,118 @@ class GameBoard(object):
             self.set(positions_handicap[i][0], positions_handicap[i][1], CONST.Black_Color)
 
     def get(self, x, y):
-        return self.board[x][y]
+        return self.board[((y + 1) * (self.width + 2)) + x + 1]
 
     def set(self, x, y, color):
-        self.board[x][y] = color
+        self._own_arrays()
+        geometry = self.geometry()
+        p = geometry.index(x, y)
+        old_color = self.board[p]
+        self.board[p] = color
+        if self._position_hash is not None:
+            keys = geometry.zobrist[p]
+            self._position_hash ^= keys[old_color] ^ keys[color]
+        if self._bit_planes is not None:
+            self._bit_planes.set_stone(p, old_color, color)
+        self._update_state_string(p)
+        if self._chains is not None and old_color != color:
+            if old_color == CONST.No_Color:
+                self._chains.place(p, color)
+            else:
+                # Stones only leave the board a whole chain at a time (see
+                # remove_stones); anything else is rare enough to just rebuild.
+                self._chains = None
+
+    def _get_chains(self):
+        if self._chains is None:
+            self._chains = ChainTracker(self)
+        return self._chains
+
+    def remove_stones(self, coords):
+        # Clear captured stones, keeping the chains up to date.
+        self._own_arrays()
+        geometry = self.geometry()
+        points = [geometry.index(x, y) for x, y in coords]
+        chains = self._chains
+        removed = []
+        if chains is not None:
+            for p in points:
+                chain = chains.chain_at(p)
+                if chain is not None and chain not in removed:
+                    removed.append(chain)
+            if len(points) != sum(len(chain.stones) for chain in removed):
+                self._chains = chains = None
+        for p in points:
+            if self._position_hash is not None:
+                self._position_hash ^= geometry.zobrist[p][self.board[p]]
+            if self._bit_planes is not None:
+                self._bit_planes.set_stone(p, self.board[p], CONST.No_Color)
+            self.board[p] = CONST.No_Color
+            self._update_state_string(p)
+        if chains is not None:
+            for chain in removed:
+                chains.remove_chain(chain)
+
+    def play(self, x, y, color):
+        # Place a stone and remove whatever it captures. Doesn't check that
+        # the move is legal: see is_stone_in_suicide, and undo.
+        record = UndoRecord(x, y, color, self._position_hash)
+        self.set(x, y, color)
+        record.ataris, record.captures = self.compute_atari_and_captures(x, y)
+        self.remove_stones(record.captures)
+        return record
+
+    def undo(self, record):
+        self.remove_stones([(record.x, record.y)])
+        captured_color = opposite_color(record.color)
+        for x, y in record.captures:
+            self.set(x, y, captured_color)
+        self._position_hash = record.position_hash
+
+    def prepare_to_share(self):
+        # Builds everything the getters would otherwise build on demand, so
+        # that requests sharing this board only ever read it.
+        self.get_position_hash()
+        self.get_state_string()
+        if self._uses_bit_planes():
+            self._get_bit_planes()
+        else:
+            self._get_chains()
+
+    def get_position_hash(self):
+        # Identifies the stones on the board (but not who owns what.)
+        if self._position_hash is None:
+            geometry = self.geometry()
+            cells = self.board
+            position_hash = 0
+            for p in geometry.points:
+                position_hash ^= geometry.zobrist[p][cells[p]]
+            self._position_hash = position_hash
+        return self._position_hash
 
     def get_owner(self, x, y):
         if self.has_owners():
-            return self.owners[x][y]
+            return self.owners[((y + 1) * (self.width + 2)) + x + 1]
         else:
             # Until the final game state, nothing is owned by either player.
             return CONST.No_Color
 
     def set_owner(self, x, y, color):
+        self._own_arrays()
         if not self.has_owners():
             # Created on demand to reduce size of Game.history.
             self.make_owners();
-        self.owners[x][y] = color
+        p = ((y + 1) * (self.width + 2)) + x + 1
+        self.owners[p] = color
+        if self._bit_planes is not None:
+            self._bit_planes.set_owner(p, color)
+        self._update_state_string(p)
+
+    def _owner_cells(self):
+        # The owners array, or None when nothing is owned yet.
+        if self.has_owners():
+            return self.owners
+        return None
 
     def get_width(self):
         return self.width
@@ -272,21 +1110,10 @@ class GameBoard(object):
         return handicap_positions(self.get_handicap(), self.size_index, self.get_version())
 
     def get_version(self):
-        # Since "_version" is new, it won't exist for old game pickles.
-        try:
-            return self._version
-        except Exception:
-            return 0
+        return self._version
 
     def has_owners(self):
-        if self.get_version() >= 3:
-            return self._has_owners
-        else:
-            # Even with boards before v3, _has_owners may be 'True'.
-            try:
-                return self._has_owners
-            except Exception:
-                return False
+        return self._has_owners
 
     def get_column_names(self):
         return CONST.Column_Names[:self.width]
@@ -298,12 +1125,7 @@ class GameBoard(object):
         return row_names
 
     def get_komi_index(self):
-        if self.get_version() >= 2:
-            return self._komi_index
-        elif self.handicap_index:
-            return CONST.Komi_None
-        else:
-            return 0
+        return self._komi_index
 
     def get_komi(self):
         return CONST.Komis[self.get_komi_index()]
@@ -313,79 +1135,135 @@ class GameBoard(object):
 
     def get_state_string(self):
         # Used for passing the board state via javascript. Smallish.
-        bs = ""
-        for y in range(self.height):
-            for x in range(self.width):
-                piece = self.get(x, y)
-                owner = self.get_owner(x, y)
-                if piece == CONST.Black_Color:
-                    if owner == CONST.White_Color:
-                        bs += "c" # dead stone
-                    else:
-                        bs += "b"
-                elif piece == CONST.White_Color:
-                    if owner == CONST.Black_Color:
-                        bs += "x" # dead stone
-                    else:
-                        bs += "w"
+        if self._state_string is None:
+            if self._state_buffer is None:
+                cells = self.board
+                owners = self._owner_cells()
+                points = self.geometry().points
+                chars = CONST.State_Chars
+                if owners is None:
+                    string = "".join([chars[cells[p] * 4] for p in points])
                 else:
-                    if owner == CONST.Black_Color:
-                        bs += "B" # black territory
-                    elif owner == CONST.White_Color:
-                        bs += "W" # white territory
-                    else:
-                        bs += "."
-        return bs
+                    string = "".join([chars[(cells[p] * 4) + owners[p]] for p in points])
+                self._state_buffer = bytearray(string)
+            self._state_string = str(self._state_buffer)
+        return self._state_string
+
+    def _update_state_string(self, p):
+        # Keep the state string's buffer in step with a changed point.
+        if self._state_buffer is not None:
+            owners = self._owner_cells()
+            owner = owners[p] if owners is not None else CONST.No_Color
+            self._state_buffer[self.geometry().offsets[p]] = ord(CONST.State_Chars[(self.board[p] * 4) + owner])
+            self._state_string = None
+
+    def _forget_state_string(self):
+        self._state_buffer = None
+        self._state_string = None
 
     def is_in_bounds(self, x, y):
         return (x >= 0) and (x < self.get_width()) and (y >= 0) and (y < self.get_height())
 
     def is_stone_in_suicide(self, x, y):
-        liberties = LibertyFinder(self, x, y)
-        return liberties.get_liberty_count() == 0
-
-    def _compute_liberties_at(self, x, y, other):
-        # returns number of liberties and connected stones
-        if not self.is_in_bounds(x, y):
-            return (0, [])
-
-        if self.get(x, y) != other:
-            return (0, [])
-
-        finder = LibertyFinder(self, x, y)
-        return (finder.get_liberty_count(), finder.get_connected_stones())
+        p = self.geometry().index(x, y)
+        if self._uses_bit_planes():
+            liberty_count = self._get_bit_planes().liberty_count(p)
+        else:
+            chain = self._get_chains().chain_at(p)
+            liberty_count = len(chain.liberties) if chain is not None else None
+        if liberty_count is None:
+            liberties = LibertyFinder(self, x, y)
+            return liberties.get_liberty_count() == 0
+        return liberty_count == 0
 
     def compute_atari_and_captures(self, x, y):
-        color = self.get(x, y)
-        other = opposite_color(color)
+        geometry = self.geometry()
+        p = geometry.index(x, y)
+        if self._uses_bit_planes():
+            return self._get_bit_planes().compute_atari_and_captures(p)
 
-        liberties = []
-        liberties.append(self._compute_liberties_at(x - 1, y, other))
-        liberties.append(self._compute_liberties_at(x, y - 1, other))
-        liberties.append(self._compute_liberties_at(x + 1, y, other))
-        liberties.append(self._compute_liberties_at(x, y + 1, other))
+        other = opposite_color(self.board[p])
+        chains = self._get_chains()
 
         ataris = 0
-        captures = []
-
-        # determine ataris and first pass on captured
-        # (there may be duplicate captured stones at first)
-        for count, connected in liberties:
+        captured = []
+
+        # A chain touching the new stone on two sides counts (as it always
+        # has) once per side for ataris, but is only captured once.
+        for n in geometry.neighbours[p]:
+            chain = chains.chain_at(n)
+            if chain is None or chain.color != other:
+                continue
+            count = len(chain.liberties)
             if count == 1:
                 ataris += 1
-            if count == 0:
-                captures.append(connected)
+            if count == 0 and chain not in captured:
+                captured.append(chain)
 
-        # flatten all captured stones into one (duplicate-free) batch
+        # Same (sorted, per chain) order that LibertyFinder always produced.
         final_captures = []
-        for capture in captures:
-            for x, y in capture:
-                # Remove duplicates (n^2 operation but shouldn't be bad in even extreme go cases)
-                if (x, y) not in final_captures:
-                    final_captures.append((x, y))
+        for chain in captured:
+            final_captures.extend(sorted(geometry.coords[s] for s in chain.stones))
 
         return (ataris, final_captures)
 
+    def compute_legal_moves(self, color, forbidden_hashes=()):
+        # One character per point, in state string order: "1" where color
+        # may move, "0" where the point is taken, the move would be suicide,
+        # or it would recreate one of the forbidden positions.
+        # Works from whichever of chains and bit planes the board's engine
+        # keeps, so that a shared board (see prepare_to_share) isn't changed.
+        geometry = self.geometry()
+        cells = self.board
+        if self._uses_bit_planes():
+            groups = self._get_bit_planes().groups()
+            group_at = groups.__getitem__
+            stones_of = _bit_points
+        else:
+            chains = self._get_chains()
+            def group_at(p):
+                chain = chains.chain_at(p)
+                return (chain, len(chain.liberties))
+            stones_of = lambda chain: chain.stones
+        other_color = opposite_color(color)
+        position_hash = self.get_position_hash() if forbidden_hashes else None
+        group_hashes = {}
+
+        legal = bytearray("0") * len(geometry.points)
+        for offset, p in enumerate(geometry.points):
+            if cells[p] != CONST.No_Color:
+                continue
+            breathes = False
+            captured = []
+            for n in geometry.neighbours[p]:
+                if cells[n] == CONST.No_Color:
+                    breathes = True
+                elif cells[n] == color:
+                    if group_at(n)[1] > 1:
+                        breathes = True
+                elif cells[n] == other_color:
+                    group, liberties = group_at(n)
+                    if liberties == 1 and group not in captured:
+                        captured.append(group)
+                        breathes = True
+            if not breathes:
+                continue
+
+            if position_hash is not None:
+                new_hash = position_hash ^ geometry.zobrist[p][color]
+                for group in captured:
+                    if group not in group_hashes:
+                        group_hash = 0
+                        for s in stones_of(group):
+                            group_hash ^= geometry.zobrist[s][other_color]
+                        group_hashes[group] = group_hash
+                    new_hash ^= group_hashes[group]
+                if new_hash in forbidden_hashes:
+                    continue
+
+            legal[offset] = ord("1")
+        return str(legal)
+
     def is_stone_of_color(self, x, y, color):
         if color == CONST.Both_Colors:
             return self.get(x, y) != CONST.No_Color
@@ -402,58 +1280,64 @@ class GameBoard(object):
         return self.is_stone_of_color(x, y, color)
 
     def compute_changed_stones(self, start_x, start_y):
+        geometry = self.geometry()
+        cells = self.board
+        owners = self._owner_cells()
+        neighbours = geometry.neighbours
+        start = geometry.index(start_x, start_y)
+
         # "color" is the color that will die (or come back to life).
-        color = self.get(start_x, start_y)
+        color = cells[start]
         other_color = opposite_color(color)
 
-        # Do a depth-first search.
-        def add_stone_to_queue(is_in_bounds, visited, queue, x, y):
-            if is_in_bounds(x, y) and visited.get(x, y) == 0:
-                visited.set(x, y, 1)
-                queue.append((x, y))
-
+        # Do a depth-first search, stopping at live stones of the other color.
+        # The border starts out visited.
         coords = []
-        queue = []
-        visited = BoardArray(width=self.width, height=self.height)
-        add_stone_to_queue(self.is_in_bounds, visited, queue, start_x, start_y)
-        while len(queue):
-            x, y = queue.pop()
-            if not self.is_alive(x, y, other_color):
-                if self.get(x, y) == color:
-                    coords.append((x, y))
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x + 1, y)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x - 1, y)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x, y + 1)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x, y - 1)
+        visited = bytearray(geometry.border)
+        visited[start] = 1
+        queue = [start]
+        while queue:
+            p = queue.pop()
+            if cells[p] == other_color and (owners is None or owners[p] == CONST.No_Color):
+                continue
+            if cells[p] == color:
+                coords.append(geometry.coords[p])
+            for n in neighbours[p]:
+                if not visited[n]:
+                    visited[n] = 1
+                    queue.append(n)
 
         return coords
 
     def search_for_owner(self, start_x, start_y):
+        geometry = self.geometry()
+        cells = self.board
+        owners = self._owner_cells()
+        neighbours = geometry.neighbours
+        start = geometry.index(start_x, start_y)
+
         found_black = False
         found_white = False
 
-        # Do a depth-first search.
-        def add_stone_to_queue(is_in_bounds, visited, queue, x, y):
-            if is_in_bounds(x, y) and visited.get(x, y) == 0:
-                visited.set(x, y, 1)
-                queue.append((x, y))
-
+        # Do a depth-first search, stopping at live stones. The border starts
+        # out visited.
         coords = []
-        queue = []
-        visited = BoardArray(width=self.width, height=self.height)
-        add_stone_to_queue(self.is_in_bounds, visited, queue, start_x, start_y)
-        while len(queue):
-            x, y = queue.pop()
-            if self.is_alive(x, y, CONST.Black_Color):
+        visited = bytearray(geometry.border)
+        visited[start] = 1
+        queue = [start]
+        while queue:
+            p = queue.pop()
+            alive = (owners is None) or (owners[p] == CONST.No_Color)
+            if alive and cells[p] == CONST.Black_Color:
                 found_black = True
-            elif self.is_alive(x, y, CONST.White_Color):
+            elif alive and cells[p] == CONST.White_Color:
                 found_white = True
             else:
-                coords.append((x, y))
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x + 1, y)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x - 1, y)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x, y + 1)
-                add_stone_to_queue(self.is_in_bounds, visited, queue, x, y - 1)
+                coords.append(geometry.coords[p])
+                for n in neighbours[p]:
+                    if not visited[n]:
+                        visited[n] = 1
+                        queue.append(n)
 
         owner = CONST.No_Color
         if found_black and not found_white:
@@ -468,57 +1352,157 @@ class GameBoard(object):
         assert CONST.White_Color < 4
         assert CONST.Black_Color < 4
 
-        status = BoardArray(width=self.width, height=self.height)
+        self._own_arrays()
+        self._forget_state_string()
+        if self._uses_bit_planes():
+            self._get_bit_planes().mark_territory(self)
+            return
+
+        geometry = self.geometry()
+        cells = self.board
+        status = geometry.make_array(CONST.No_Color)
 
         # Initialize "status" to have boundaries of live stones.
         found_live_stones = False
         found_dead_stones = False
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.is_alive(x, y):
-                    status.set(x, y, self.get(x, y))
-                    found_live_stones = True
-                else:
-                    status.set(x, y, CONST.No_Color)
-                    if not found_dead_stones and self.is_dead(x, y):
-                        found_dead_stones = True
+        owners = self._owner_cells()
+        for p in geometry.points:
+            if cells[p] != CONST.No_Color and (owners is None or owners[p] == CONST.No_Color):
+                status[p] = cells[p]
+                found_live_stones = True
+            elif cells[p] != CONST.No_Color:
+                found_dead_stones = True
 
         if found_dead_stones and not found_live_stones:
             # It doesn't make sense that every stone is dead.  Resurrect all of
             # them.
-            for x in range(self.width):
-                for y in range(self.height):
-                    self.set_owner(x, y, CONST.No_Color)
-                    status.set(x, y, self.get(x, y))
-
-        # Find the territories, and save the corresponding owners.
-        for x in range(self.width):
-            for y in range(self.height):
-                if status.get(x, y) == CONST.No_Color:
-                    coords, owner = self.search_for_owner(x, y)
-                    for a, b in coords:
-                        status.set(a, b, owner + 4)
+            self.make_owners()
+            for p in geometry.points:
+                status[p] = cells[p]
+
+        # Label the territories in one pass: each empty (or dead) point joins
+        # the regions to its left and above, and every region collects the
+        # colors of the live stones around it.
+        parent = range(geometry.size)
+        borders = [CONST.No_Color] * geometry.size
+
+        def find(p):
+            while parent[p] != p:
+                parent[p] = parent[parent[p]]
+                p = parent[p]
+            return p
+
+        free = []
+        for p in geometry.points:
+            if status[p] != CONST.No_Color:
+                continue
+            free.append(p)
+            left, above, right, below = geometry.neighbours[p]
+            for n in (left, above):
+                if status[n] == CONST.No_Color:
+                    root = find(n)
+                    if root != p:
+                        parent[root] = p
+                        borders[p] |= borders[root]
+            for n in (left, above, right, below):
+                if status[n] < CONST.Off_Board:
+                    borders[p] |= status[n]
 
         # Set the calculated owners.
-        for x in range(self.width):
-            for y in range(self.height):
-                owner = status.get(x, y)
-                if owner >= 4:
-                    owner = owner - 4
-                    if self.is_stone_of_color(x, y, owner):
-                        self.set_owner(x, y, CONST.No_Color)
+        if free and not self.has_owners():
+            self.make_owners()
+        owners = self.owners
+        for p in free:
+            owner = borders[find(p)]
+            if owner == CONST.Both_Colors or cells[p] == owner:
+                owner = CONST.No_Color
+            owners[p] = owner
+
+    def remark_territory(self, stones, owner):
+        # Mark stones dead (or alive) starting from an already marked board,
+        # re-labelling only the regions around them. Returns the change in
+        # each color's territory count, or None if the whole board had to be
+        # marked again.
+        self._own_arrays()
+        geometry = self.geometry()
+        cells = self.board
+        owners = self._owner_cells()
+        if owners is None:
+            for x, y in stones:
+                self.set_owner(x, y, owner)
+            self.mark_territory()
+            return None
+
+        bit_planes = self._bit_planes
+        delta = [0, 0, 0, 0]
+
+        def change_owner(p, color):
+            old = owners[p]
+            if old != CONST.No_Color:
+                delta[old] -= 1
+                if cells[p] == opposite_color(old):
+                    delta[old] -= 1
+            if color != CONST.No_Color:
+                delta[color] += 1
+                if cells[p] == opposite_color(color):
+                    delta[color] += 1
+            owners[p] = color
+            if bit_planes is not None:
+                bit_planes.set_owner(p, color)
+            self._update_state_string(p)
+
+        points = [geometry.index(x, y) for x, y in stones]
+        for p in points:
+            change_owner(p, owner)
+
+        # Only regions that contain a changed stone, or touch one, can have
+        # changed. Flood each of them once.
+        visited = bytearray(geometry.border)
+        for p in points:
+            for seed in (p,) + geometry.neighbours[p]:
+                if visited[seed] or (cells[seed] != CONST.No_Color and owners[seed] == CONST.No_Color):
+                    continue
+                visited[seed] = 1
+                region = [seed]
+                found = CONST.No_Color
+                i = 0
+                while i < len(region):
+                    for n in geometry.neighbours[region[i]]:
+                        if visited[n]:
+                            continue
+                        if cells[n] != CONST.No_Color and owners[n] == CONST.No_Color:
+                            found |= cells[n]
+                        else:
+                            visited[n] = 1
+                            region.append(n)
+                    i += 1
+                if found == CONST.No_Color:
+                    # Every stone is dead; let mark_territory resurrect them.
+                    self.mark_territory()
+                    return None
+                for q in region:
+                    if found == CONST.Both_Colors or cells[q] == found:
+                        change_owner(q, CONST.No_Color)
                     else:
-                        self.set_owner(x, y, owner)
+                        change_owner(q, found)
+
+        return delta
 
     def count_territory(self, color, captures=0):
+        if self._uses_bit_planes():
+            return self._get_bit_planes().count_territory(color, captures)
+
         count = captures
+        owners = self._owner_cells()
+        if owners is None:
+            return count
+        cells = self.board
         opposite = opposite_color(color)
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.get_owner(x, y) == color:
+        for p in self.geometry().points:
+            if owners[p] == color:
+                count = count + 1
+                if cells[p] == opposite:
                     count = count + 1
-                    if self.get(x, y) == opposite:
-                        count = count + 1
         return count
 
     def count_white_territory(self, black_stones_captured):
@@ -531,7 +1515,17 @@ class GameBoard(object):
         return CONST.Board_Classes[self.size_index]
 
     def clone(self):
-        return copy.deepcopy(self)
+        # Cheap: the clone shares this board's arrays until either of them
+        # writes; see _own_arrays. This board may be one that other threads
+        # are cloning too (see GameStateCache), hence the lock.
+        clone = GameBoard.__new__(GameBoard)
+        with GameBoard._clone_lock:
+            clone.__dict__.update(self.__dict__)
+            self._copy_on_write = True
+        clone._copy_on_write = True
+        if self._bit_planes is not None:
+            clone._bit_planes = self._bit_planes.clone()
+        return clone
 
 class GameState(object):
     def __init__(self):
@@ -554,6 +1548,26 @@ class GameState(object):
         self.white_done_number = -1
         self.winner = CONST.No_Color
 
+        # Position hash of the state before this one, for the rule of Ko.
+        self.previous_position_hash = None
+
+        # How this state was made from the one before it; see after_action.
+        self.last_action = None
+
+    def __setstate__(self, state):
+        # Older pickles lack the fields added since; fill them in here, once,
+        # rather than in every getter. They're written back with the next
+        # state the game saves.
+        self.scoring_number = -1
+        self.white_territory = 0
+        self.black_territory = 0
+        self.black_done_number = -1
+        self.white_done_number = -1
+        self.winner = CONST.No_Color
+        self.previous_position_hash = None
+        self.last_action = None
+        self.__dict__.update(state)
+
     def to_jsonable(self):
         return {
             'board': self.board.to_jsonable() if self.board is not None else None,
@@ -567,8 +1581,8 @@ class GameState(object):
             'scoring_number': self.get_scoring_number(),
             'white_territory': self.get_white_territory(),
             'black_territory': self.get_black_territory(),
-            'black_done_number': getattr(self, 'black_done_number', -1),
-            'white_done_number': getattr(self, 'white_done_number', -1),
+            'black_done_number': self.black_done_number,
+            'white_done_number': self.white_done_number,
             'winner': self.get_winner(),
         }
 
@@ -600,28 +1614,10 @@ class GameState(object):
         self.black_stones_captured = bsc
 
     def get_scoring_number(self):
-        if self.get_version() < 3:
-            try:
-                return self.scoring_number
-            except Exception:
-                # Need to support old games that enter the scoring stage.
-                return -1
-        else:
-            return self.scoring_number
+        return self.scoring_number
 
     def increment_scoring_number(self):
-        if self.get_version() < 3:
-            try:
-                self.scoring_number += 1
-            except Exception:
-                # Need to support old games that enter the scoring stage.
-                self.scoring_number = 0
-                self.white_done_number = -1
-                self.black_done_number = -1
-                self.white_territory = 0
-                self.black_territory = 0
-        else:
-            self.scoring_number += 1
+        self.scoring_number += 1
 
     def has_scoring_data(self):
         return self.get_scoring_number() >= 0
@@ -649,13 +1645,7 @@ class GameState(object):
             self.black_done_number = self.get_scoring_number()
 
     def get_winner(self):
-        if self.get_version() < 3:
-            try:
-                return self.winner
-            except Exception:
-                return CONST.No_Color
-        else:
-            return self.winner
+        return self.winner
 
     def is_winner(self, color):
         return color == self.get_winner()
@@ -681,11 +1671,46 @@ class GameState(object):
     def set_black_territory(self, territory):
         self.black_territory = territory
 
+    def prepare_to_share(self):
+        self.get_board().prepare_to_share()
+
     def count_territory(self):
         board = self.get_board()
         self.set_black_territory(board.count_black_territory(self.get_white_stones_captured()))
         self.set_white_territory(board.count_white_territory(self.get_black_stones_captured()))
 
+    def play(self, x, y, color):
+        record = self.get_board().play(x, y, color)
+        record.white_stones_captured = self.get_white_stones_captured()
+        record.black_stones_captured = self.get_black_stones_captured()
+        if color == CONST.Black_Color:
+            self.set_white_stones_captured(record.white_stones_captured + len(record.captures))
+        else:
+            self.set_black_stones_captured(record.black_stones_captured + len(record.captures))
+        return record
+
+    def undo(self, record):
+        self.get_board().undo(record)
+        self.set_white_stones_captured(record.white_stones_captured)
+        self.set_black_stones_captured(record.black_stones_captured)
+
+    def mark_stones(self, stones, owner):
+        # Adjusts the territory counts by however much marking these stones
+        # changed them, rather than counting the whole board again.
+        board = self.get_board()
+        if not self.has_scoring_data():
+            for x, y in stones:
+                board.set_owner(x, y, owner)
+            board.mark_territory()
+            self.count_territory()
+            return
+        delta = board.remark_territory(stones, owner)
+        if delta is None:
+            self.count_territory()
+        else:
+            self.set_black_territory(self.get_black_territory() + delta[CONST.Black_Color])
+            self.set_white_territory(self.get_white_territory() + delta[CONST.White_Color])
+
     def get_last_move_message(self):
         return self.last_move_message
 
@@ -713,6 +1738,95 @@ class GameState(object):
     def set_last_move_was_pass(self, was_pass):
         self.last_move_was_pass = was_pass
 
+    def get_previous_position_hash(self):
+        # None for older states; callers fall back to the history.
+        return self.previous_position_hash
+
+    def set_previous_position_hash(self, position_hash):
+        self.previous_position_hash = position_hash
+
+    def get_last_action(self):
+        # None for older states, and for states edited after they were made
+        # (clone doesn't copy it.)
+        return self.last_action
+
+    def set_last_action(self, action):
+        self.last_action = action
+
+    def _next_state(self, color):
+        new_state = self.clone()
+        new_state.increment_current_move_number()
+        new_state.set_whose_move(opposite_color(color))
+        new_state.set_previous_position_hash(self.get_board().get_position_hash())
+        return new_state
+
+    def after_move(self, x, y, color):
+        # The state after color moves at x, y, and the move's UndoRecord.
+        # Doesn't check that the move is legal; see MakeThisMoveHandler.
+        new_state = self._next_state(color)
+        new_state.set_last_move_was_pass(False)
+        move = new_state.play(x, y, color)
+
+        # Describe captures and (new) ataris
+        move_message = "It's your turn to move"
+        if move.ataris > 0:
+            if move.ataris == 1:
+                move_message += "; you were just placed in atari"
+            else:
+                move_message += "; you were just placed in double atari"
+
+        if len(move.captures) > 0:
+            if move.ataris == 0:
+                move_message += ";"
+            else:
+                move_message += " and"
+            if len(move.captures) == 1:
+                move_message += " one of your stones was captured"
+            else:
+                move_message += " %d of your stones were captured" % len(move.captures)
+
+        move_message += "."
+
+        new_state.set_last_move_message(move_message)
+        new_state.set_last_move(x, y)
+        new_state.set_last_action((CONST.Move_Action, x, y))
+        return new_state, move
+
+    def after_pass(self, color):
+        # Two passes in a row start scoring.
+        new_state = self._next_state(color)
+        new_state.set_last_move_was_pass(True)
+
+        if self.get_last_move_was_pass():
+            move_message = "Mark the dead stones. Click done when finished. When you and your opponent agree, the game will end."
+            new_state.increment_scoring_number()
+            new_state.get_board().mark_territory()
+            new_state.count_territory()
+        else:
+            move_message = "Your opponent passed. You can make a move, or you can pass again to end the game."
+
+        new_state.set_last_move_message(move_message)
+        new_state.set_last_action((CONST.Pass_Action,))
+        return new_state
+
+    def after_resign(self, color):
+        new_state = self._next_state(color)
+        new_state.set_last_move_was_pass(True)
+        new_state.set_winner(opposite_color(color))
+        new_state.set_last_move_message("The game is over!")
+        new_state.set_last_action((CONST.Resign_Action,))
+        return new_state
+
+    def after_action(self, action):
+        # Replays an action recorded by after_move, after_pass or after_resign.
+        if action[0] == CONST.Move_Action:
+            return self.after_move(action[1], action[2], self.whose_move)[0]
+        elif action[0] == CONST.Pass_Action:
+            return self.after_pass(self.whose_move)
+        elif action[0] == CONST.Resign_Action:
+            return self.after_resign(self.whose_move)
+        raise ValueError("Unknown history action %r" % (action,))
+
     def clone(self):
         clone = GameState()
         clone.white_stones_captured = self.white_stones_captured
@@ -723,6 +1837,7 @@ class GameState(object):
         clone.board = self.board.clone()
         clone.last_move = self.last_move
         clone.last_move_was_pass = self.last_move_was_pass
+        clone.previous_position_hash = self.get_previous_position_hash()
 
         # Added in v3 of GameBoard.
         if self.has_scoring_data():
@@ -780,103 +1895,38 @@ class LibertyFinder(object):
         self.color = self.board.get(self.start_x, self.start_y)
         self.connected_stones = []
         self.liberty_count = -1
-        self._make_found()
         self._find_connected_stones()
         self._count_liberties()
 
-    def _make_found(self):
-        w = self.board.get_width()
-        h = self.board.get_height()
-
-        self.reached = []
-        for x in range(w):
-            self.reached.append([False] * h)
-
     def _find_connected_stones(self):
-        q = [(self.start_x, self.start_y)]
-
-        # Flood-fill on the color
-        while len(q) > 0:
-            # dequeue
-            x, y = q[0]
-            q = q[1:]
-
-            self.reached[x][y] = True
-            self.connected_stones.append((x, y))
-
-            # left
-            if (x - 1) >= 0:
-                left = self.board.get(x - 1, y)
-                if left == self.color and not self.reached[x - 1][y]:
-                    q.append((x - 1, y))
-
-            # top
-            if (y - 1) >= 0:
-                top = self.board.get(x, y - 1)
-                if top == self.color and not self.reached[x][y - 1]:
-                    q.append((x, y - 1))
-
-            # right
-            if (x + 1) < self.board.get_width():
-                right = self.board.get(x + 1, y)
-                if right == self.color and not self.reached[x + 1][y]:
-                    q.append((x + 1, y))
-
-            # bottom
-            if (y + 1) < self.board.get_height():
-                bottom = self.board.get(x, y + 1)
-                if bottom == self.color and not self.reached[x][y + 1]:
-                    q.append((x, y + 1))
+        geometry = self.board.geometry()
+        cells = self.board.board
+        start = geometry.index(self.start_x, self.start_y)
+
+        # Flood-fill on the color; the border never matches it.
+        self.reached = set([start])
+        q = [start]
+        while q:
+            p = q.pop()
+            for n in geometry.neighbours[p]:
+                if cells[n] == self.color and n not in self.reached:
+                    self.reached.add(n)
+                    q.append(n)
 
         # force a canoncial order for connected stones
         # so that we can determine if two sets of
         # connected stones are the same
-        self.connected_stones.sort()
-
-    def _get_liberty_count_at(self, x, y, w, h, already_counted):
-        libs = 0
-
-        # left liberty?
-        if (x - 1) >= 0:
-            left = self.board.get(x - 1, y)
-            if left == CONST.No_Color and not already_counted[x - 1][y]:
-                libs += 1
-                already_counted[x - 1][y] = True
-
-        # top liberty?
-        if (y - 1) >= 0:
-            top = self.board.get(x, y - 1)
-            if top == CONST.No_Color and not already_counted[x][y - 1]:
-                libs += 1
-                already_counted[x][y - 1] = True
-
-        # right liberty?
-        if (x + 1) < w:
-            right = self.board.get(x + 1, y)
-            if right == CONST.No_Color and not already_counted[x + 1][y]:
-                libs += 1
-                already_counted[x + 1][y] = True
-
-        # bottom liberty?
-        if (y + 1) < h:
-            bottom = self.board.get(x, y + 1)
-            if bottom == CONST.No_Color and not already_counted[x][y + 1]:
-                libs += 1
-                already_counted[x][y + 1] = True
-
-        return libs
+        self.connected_stones = sorted(geometry.coords[p] for p in self.reached)
 
     def _count_liberties(self):
-        w = self.board.get_width()
-        h = self.board.get_height()
-        already_counted = []
-        for x in range(w):
-            already_counted.append([False] * h)
-
-        self.liberty_count = 0
-        for connected_stone in self.connected_stones:
-            x, y = connected_stone
-            self.liberty_count += self._get_liberty_count_at(x, y, w, h, already_counted)
+        geometry = self.board.geometry()
+        cells = self.board.board
+        liberties = set()
+        for p in self.reached:
+            for n in geometry.neighbours[p]:
+                if cells[n] == CONST.No_Color:
+                    liberties.add(n)
+        self.liberty_count = len(liberties)
 
     def get_liberty_count(self):
         return self.liberty_count
@@ -915,9 +1965,11 @@ class GameCookie(object):
             two = GameCookie.random_cookie()
             while one == two:
                 two = GameCookie.random_cookie()
-            test_one = Player.all().filter('cookie =', one).get()
-            test_two = Player.all().filter('cookie =', two).get()
+            test_one, test_two = Player.get_by_key_name([Player.key_name_for(one), Player.key_name_for(two)])
             unique = (test_one is None) and (test_two is None)
+            if unique:
+                # Players not yet keyed by cookie are only found by query.
+                unique = (Player.get_unkeyed_by_cookie(one) is None) and (Player.get_unkeyed_by_cookie(two) is None)
 
         return (one, two)
 
@@ -1230,53 +2282,542 @@ class TwitterHelper(object):
             message = "Just a reminder: it's still your turn to move; you haven't moved in over a week. %s" % TwitterHelper._game_url(player_cookie)
         return TwitterHelper.send_notification_to_user(player_twitter, message)
 
+#------------------------------------------------------------------------------
+# LRUCache: a bounded, thread-safe, in-process cache
+#------------------------------------------------------------------------------
+
+class LRUCache(object):
+    def __init__(self, capacity):
+        super(LRUCache, self).__init__()
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, is_valid=None):
+        # An entry that is_valid rejects is dropped and counts as a miss.
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None or (is_valid is not None and not is_valid(value)):
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, matches):
+        with self._lock:
+            for key in [key for key in self._entries if matches(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'capacity': self.capacity}
+
+class CacheCounters(object):
+    def __init__(self):
+        super(CacheCounters, self).__init__()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+class CacheLease(object):
+    # Stampede protection for memcache: the first request to miss a key
+    # takes its lease (a memcache add) and refills it from the datastore,
+    # and the rest wait for that rather than all going to the datastore
+    # at once. A lease expires by itself if its holder dies.
+
+    def __init__(self, key):
+        super(CacheLease, self).__init__()
+        self.key = "lease:" + key
+        self.held = memcache.add(self.key, 1, time=CONST.Cache_Lease_Seconds)
+
+    def wait(self, fetch):
+        # Polls fetch, a memcache read, until it finds something. None if
+        # the holder is taking too long; go to the datastore after all.
+        for attempt in range(CONST.Cache_Lease_Polls):
+            time.sleep(CONST.Cache_Lease_Poll_Seconds)
+            value = fetch()
+            if value is not None:
+                return value
+        return None
+
+    def release(self):
+        if self.held:
+            memcache.delete(self.key)
+
+
 #------------------------------------------------------------------------------
 # Models
 #------------------------------------------------------------------------------
 
 class ModelCache(object):
+    # Players by cookie, in a per-instance LRU in front of memcache. The
+    # LRU is trusted for Player_Cache_Seconds, which is how long another
+    # instance's change can go unseen; after that its entry is only served
+    # while some other request is refilling memcache (see CacheLease).
+    # Cookies with no player are cached as False for a few minutes, so that
+    # repeats don't reach the datastore. memcache keys get a prefix, since
+    # a cookie is whatever the client sent and mustn't name anything else
+    # there (a lease, a limiter bucket or a game.)
+    _key_prefix = "player:"
+    _players = LRUCache(CONST.Player_Cache_Size)
+    _counters = CacheCounters()
+
     @staticmethod
-    def player_by_cookie(cookie):
-        player = memcache.get(cookie)
-        if player is not None:
+    def _remember(cookie, player, now):
+        # The LRU holds players encoded, so that every request gets a copy
+        # of its own to change.
+        ModelCache._players.set(cookie, (db.model_to_protobuf(player).Encode() if player else False, now))
+
+    @staticmethod
+    def _recall(entry):
+        return db.model_from_protobuf(entry[0]) if entry[0] else None
+
+    @staticmethod
+    def _from_memcache(cookie):
+        # Players cached before they were keyed by cookie are looked up
+        # again, which moves them to their cookie key.
+        player = memcache.get(ModelCache._key_prefix + cookie)
+        if player is False or (player is not None and player.key().name() is not None):
+            ModelCache._remember(cookie, player, time.time())
             return player
+        return None
+
+    @staticmethod
+    def player_by_cookie(cookie, limiter=None):
+        # A limiter, if given, decides whether a cookie memcache doesn't
+        # know gets the full lookup, and hears about each one that turns
+        # out to be unknown. Without it only the cheap keyed get is made,
+        # which still finds every player but those not yet keyed by cookie.
+        entry = ModelCache._players.get(cookie)
+        if entry is not None and time.time() - entry[1] < CONST.Player_Cache_Seconds:
+            ModelCache._counters.count('local_hits')
+            return ModelCache._recall(entry)
+        player = ModelCache._from_memcache(cookie)
+        if player is not None:
+            ModelCache._counters.count('memcache_hits')
+            return player or None
+        allowed = limiter is None or limiter.allow()
+
+        lease = CacheLease(ModelCache._key_prefix + cookie)
+        if lease.held:
+            ModelCache._counters.count('leases')
         else:
-            player = Player.all().filter("cookie = ", cookie).get()
+            if entry is not None:
+                ModelCache._counters.count('stale_hits')
+                return ModelCache._recall(entry)
+            ModelCache._counters.count('lease_waits')
+            player = lease.wait(lambda: ModelCache._from_memcache(cookie))
             if player is not None:
-                memcache.set(cookie, player)
-            return player
+                return player or None
+            ModelCache._counters.count('lease_timeouts')
+
+        ModelCache._counters.count('misses')
+        try:
+            if allowed:
+                player = Player.get_by_cookie(cookie)
+            else:
+                player = Player.get_by_key_name(Player.key_name_for(cookie))
+            # A miss is only cached if older players were searched too.
+            if player is not None:
+                memcache.set(ModelCache._key_prefix + cookie, player)
+                ModelCache._remember(cookie, player, time.time())
+            elif allowed:
+                memcache.set(ModelCache._key_prefix + cookie, False, time=CONST.Unknown_Cookie_Seconds)
+                ModelCache._remember(cookie, player, time.time())
+            if player is None and limiter is not None:
+                limiter.spend()
+        finally:
+            lease.release()
+        return player
+
+    @staticmethod
+    def players_by_cookies(cookies):
+        # {cookie: player} for those of cookies that have a player, from one
+        # memcache get_multi and one datastore get for the rest.
+        cookies = list(set(cookies))
+        players = {}
+        unknown = set()
+        now = time.time()
+        for cookie in cookies:
+            entry = ModelCache._players.get(cookie)
+            if entry is not None and now - entry[1] < CONST.Player_Cache_Seconds:
+                ModelCache._counters.count('local_hits')
+                if entry[0] is False:
+                    unknown.add(cookie)
+                else:
+                    players[cookie] = ModelCache._recall(entry)
+        cookies = [cookie for cookie in cookies if cookie not in players and cookie not in unknown]
+        if not cookies:
+            return players
+        for cookie, player in memcache.get_multi(cookies, key_prefix=ModelCache._key_prefix).items():
+            if player is False:
+                unknown.add(cookie)
+            elif player.key().name() is not None:
+                players[cookie] = player
+            else:
+                continue
+            ModelCache._counters.count('memcache_hits')
+            ModelCache._remember(cookie, player, now)
+        missing = [cookie for cookie in cookies if cookie not in players and cookie not in unknown]
+        if missing:
+            found = {}
+            not_found = {}
+            for cookie, player in zip(missing, Player.get_by_key_name([Player.key_name_for(cookie) for cookie in missing])):
+                ModelCache._counters.count('misses')
+                if player is None:
+                    player = Player.get_unkeyed_by_cookie(cookie)
+                if player is not None:
+                    found[cookie] = player
+                else:
+                    not_found[cookie] = False
+                ModelCache._remember(cookie, player, now)
+            if found:
+                memcache.set_multi(found, key_prefix=ModelCache._key_prefix)
+                players.update(found)
+            if not_found:
+                memcache.set_multi(not_found, time=CONST.Unknown_Cookie_Seconds, key_prefix=ModelCache._key_prefix)
+        return players
 
     @staticmethod
     def clear_cookie(cookie):
-        memcache.delete(cookie)
+        ModelCache._players.delete(cookie)
+        memcache.delete(ModelCache._key_prefix + cookie)
+
+    @staticmethod
+    def get_stats():
+        stats = ModelCache._counters.get_stats()
+        stats['local'] = ModelCache._players.get_stats()
+        return stats
+
+class CookieLimiter(object):
+    # Token buckets in memcache, one per client IP and one per cookie,
+    # that limit how often cookies memcache doesn't know get the full
+    # lookup; see ModelCache.player_by_cookie. Only unknown cookies spend
+    # tokens, and an empty bucket only skips the search for players not yet
+    # keyed by cookie, so players are never held up. A bucket memcache has lost is simply full again.
+
+    def __init__(self, ip, cookie):
+        super(CookieLimiter, self).__init__()
+        self.buckets = {
+            "bucket-ip:" + ip: (CONST.Unknown_Cookie_IP_Burst, CONST.Unknown_Cookie_IP_Per_Second),
+            "bucket-cookie:" + cookie: (CONST.Unknown_Cookie_Burst, CONST.Unknown_Cookie_Per_Second),
+        }
+
+    def _tokens(self, key, value, now):
+        # A bucket's value is (tokens, time it had them).
+        burst, per_second = self.buckets[key]
+        if value is None:
+            return burst
+        tokens, then = value
+        return min(burst, tokens + (now - then) * per_second)
+
+    def allow(self):
+        now = time.time()
+        values = memcache.get_multi(self.buckets.keys())
+        return all(self._tokens(key, values.get(key), now) >= 1 for key in self.buckets)
+
+    def spend(self):
+        client = memcache.Client()
+        for key, (burst, per_second) in self.buckets.items():
+            time_to_refill = int(burst / per_second) + 1
+            for attempt in range(CONST.Memcache_CAS_Attempts):
+                now = time.time()
+                value = client.gets(key)
+                spent = (max(self._tokens(key, value, now) - 1, 0), now)
+                if value is None:
+                    if client.add(key, spent, time=time_to_refill):
+                        break
+                elif client.cas(key, spent, time=time_to_refill):
+                    break
+
+class GameStateCache(object):
+    # Decoded current states, keyed by (game key, move number, scoring
+    # number) and shared by every request this instance serves, so treat
+    # them as read-only: clone before changing. Each entry keeps the blob it
+    # came from, and is only used if the game still has that blob; that
+    # covers changes that don't bump either number (DoneHandler) and
+    # commits made by other instances. Nothing is built lazily on a cached
+    # state; see GameState.prepare_to_share.
+    _cache = LRUCache(CONST.Game_State_Cache_Size)
+
+    @staticmethod
+    def _key(game):
+        return (str(game.key()), game.get_current_move_number(), game.scoring_number)
+
+    @staticmethod
+    def get(game):
+        blob = game.current_state
+        entry = GameStateCache._cache.get(GameStateCache._key(game), lambda entry: entry[0] == blob)
+        if entry is not None:
+            return entry[1]
+        state = safe_pickle_loads(blob)
+        state.prepare_to_share()
+        GameStateCache._cache.set(GameStateCache._key(game), (blob, state))
+        return state
+
+    @staticmethod
+    def replace(game, state):
+        # Called when a game commits a new state: drop its older states.
+        game_key = str(game.key())
+        state.prepare_to_share()
+        GameStateCache._cache.delete_matching(lambda key: key[0] == game_key)
+        GameStateCache._cache.set(GameStateCache._key(game), (game.current_state, state))
+
+    @staticmethod
+    def get_stats():
+        return GameStateCache._cache.get_stats()
+
+class GameCache(object):
+    # Games by key, written through whenever one is put. memcache maps each
+    # game to its current version: its move number, scoring number and a
+    # checksum of the entity, since DoneHandler changes neither number. The
+    # entity for a version never changes, so it's kept in memcache and in a
+    # per-instance LRU under that version; a poll that finds the same
+    # version as last time costs one small memcache get. Every get returns a
+    # new Game, so callers can change and put it as usual.
+    _entities = LRUCache(CONST.Game_Cache_Size)
+    _counters = CacheCounters()
+
+    @staticmethod
+    def _version_key(game_key):
+        return "game:" + str(game_key)
+
+    @staticmethod
+    def _entity_key(game_key, version):
+        return "game:%s:%d:%d:%d" % ((str(game_key),) + version)
+
+    @staticmethod
+    def _store(game, written):
+        entity = db.model_to_protobuf(game).Encode()
+        scoring_number = game.scoring_number if game.scoring_number is not None else -1
+        version = (game.get_history_length(), scoring_number, zlib.crc32(entity) & 0xffffffff)
+        game_key = game.key()
+        GameCache._entities.set((str(game_key), version), entity)
+        memcache.set(GameCache._entity_key(game_key, version), entity, time=CONST.Game_Cache_Seconds)
+
+        # A game read from the datastore only fills an empty slot; a write
+        # replaces whatever's there unless it's from a later move or scoring
+        # round, and gives up (leaving nothing cached) if it keeps losing
+        # the race.
+        version_key = GameCache._version_key(game_key)
+        if not written:
+            memcache.add(version_key, version, time=CONST.Game_Cache_Seconds)
+            return
+        client = memcache.Client()
+        for attempt in range(CONST.Memcache_CAS_Attempts):
+            current = client.gets(version_key)
+            if current is None:
+                if client.add(version_key, version, time=CONST.Game_Cache_Seconds):
+                    return
+            elif current[:2] > version[:2]:
+                return
+            elif client.cas(version_key, version, time=CONST.Game_Cache_Seconds):
+                return
+        memcache.delete(version_key)
+
+    @staticmethod
+    def _from_memcache(game_key):
+        version = memcache.get(GameCache._version_key(game_key))
+        if version is None:
+            return None
+        entity = GameCache._entities.get((str(game_key), version))
+        if entity is not None:
+            GameCache._counters.count('local_hits')
+            return db.model_from_protobuf(entity)
+        entity = memcache.get(GameCache._entity_key(game_key, version))
+        if entity is None:
+            return None
+        GameCache._counters.count('memcache_hits')
+        GameCache._entities.set((str(game_key), version), entity)
+        return db.model_from_protobuf(entity)
+
+    @staticmethod
+    def get(game_key):
+        # Unlike players, a stale game is never served: requests that miss
+        # while another refills the cache wait for it instead.
+        game = GameCache._from_memcache(game_key)
+        if game is not None:
+            return game
+        lease = CacheLease(str(game_key))
+        if lease.held:
+            GameCache._counters.count('leases')
+        else:
+            GameCache._counters.count('lease_waits')
+            game = lease.wait(lambda: GameCache._from_memcache(game_key))
+            if game is not None:
+                return game
+            GameCache._counters.count('lease_timeouts')
+        GameCache._counters.count('misses')
+        try:
+            game = Game.get(game_key)
+            if game is not None:
+                GameCache._store(game, False)
+        finally:
+            lease.release()
+        return game
+
+    @staticmethod
+    def written(game):
+        # Called once game has been put.
+        GameCache._store(game, True)
+
+    @staticmethod
+    def forget(game_key):
+        # For writes that can't pass the game along, like transactions.
+        memcache.delete(GameCache._version_key(game_key))
+
+    @staticmethod
+    def get_stats():
+        stats = GameCache._counters.get_stats()
+        stats['local'] = GameCache._entities.get_stats()
+        return stats
+
+def encode_history_action(action):
+    # A zero byte can't start a pickle, so these never look like keyframes.
+    if action[0] == CONST.Move_Action:
+        return "\x00" + action[0] + chr(action[1]) + chr(action[2])
+    return "\x00" + action[0]
+
+def decode_history_action(entry):
+    # The action for a history entry, or None if it's a keyframe.
+    if not entry.startswith("\x00") or entry[1] == CONST.Board_Reference:
+        return None
+    if entry[1] == CONST.Move_Action:
+        return (entry[1], ord(entry[2]), ord(entry[3]))
+    return (entry[1],)
+
+def encode_board_reference(digest, state_fields):
+    return "\x00" + CONST.Board_Reference + digest + state_fields
+
+def decode_board_reference(entry):
+    # (board hash, state fields) for a keyframe that refers to a stored
+    # board, or None for any other history entry.
+    if not entry.startswith("\x00" + CONST.Board_Reference):
+        return None
+    return entry[2:22], entry[22:]
+
+class BoardPayload(db.Model):
+    # A board from a game's history, as encoded by split_game_state, keyed
+    # "board<sha1>" under the game so each distinct board is stored once.
+    payload = db.BlobProperty()
+
+    @staticmethod
+    def key_name_for(digest):
+        return "board" + digest.encode('hex')
+
+class HistoryChunk(db.Model):
+    # Entries [n * CONST.History_Chunk_Size, (n + 1) * CONST.History_Chunk_Size)
+    # of a game's history, keyed "chunk<n>" under the game.
+    entries = db.ListProperty(db.Blob)
+
+    @staticmethod
+    def key_name_for(chunk_index):
+        return "chunk%d" % chunk_index
+
+class ChatMessage(db.Model):
+    # One line of a game's chat, stored under the game and keyed by its
+    # sequence number, so the lines after any given one are a key range.
+    cookie = db.StringProperty()
+    message = db.TextProperty()
+    move_number = db.IntegerProperty()
+
+    @staticmethod
+    def key_for(game_key, sequence):
+        return db.Key.from_path(ChatMessage.kind(), "line%08d" % sequence, parent=game_key)
+
+    def get_chat_entry(self):
+        return ChatEntry(self.cookie, self.message, self.move_number)
+
+class GameArchive(db.Model):
+    # Keyed "archive" under a finished game: its history, chat and final
+    # state in one compressed record. See Game.archive.
+    record = db.BlobProperty()
+
+    @staticmethod
+    def encode_record(history, chat, final_state):
+        parts = []
+        _encode_value((history, chat, final_state), parts)
+        return _Game_Archive_Magic + zlib.compress("".join(parts), 9)
+
+    @staticmethod
+    def decode_record(s):
+        if not s.startswith(_Game_Archive_Magic):
+            raise ValueError("Not a game archive")
+        return _decode_value(zlib.decompress(s[len(_Game_Archive_Magic):]), 0)[0]
+
+class ChatLog(db.Model):
+    # Keyed "chat" under its game: how many lines of chat the game has,
+    # counting any older ones kept in Game.chat_history.
+    count = db.IntegerProperty(default=0)
 
 class Game(db.Model):
     date_created = db.DateTimeProperty(auto_now=False)
     date_last_moved = db.DateTimeProperty(auto_now=False)
-    history = db.ListProperty(db.Blob)
     current_state = db.BlobProperty()
 
+    # History is kept in HistoryChunk children, so that fetching a game
+    # doesn't fetch it. Older games keep it inline in history (and have no
+    # history_count) until their next move; see move_history_to_chunks.
+    history = db.ListProperty(db.Blob)
+    history_count = db.IntegerProperty()
+
     # Back reference the players
     black_cookie = db.StringProperty()
     white_cookie = db.StringProperty()
 
-    # Recent chat
+    # Chat from before ChatMessage; new lines never go here.
     chat_history = db.ListProperty(db.Blob)
 
+    # Mirrors current_state's scoring number; see set_current_state.
+    scoring_number = db.IntegerProperty()
+
     is_finished = db.BooleanProperty(default=False)
     has_scoring_data = db.BooleanProperty(default=False)
     reminder_send_time = db.DateTimeProperty(auto_now=False)
 
+    # Archived games keep their history and chat in a GameArchive instead
+    # of in chunks and messages; see archive().
+    archived = db.BooleanProperty(default=False)
+
+    # Opt-in positional superko: every board position the game has seen.
+    superko = db.BooleanProperty(default=False)
+    position_hashes = db.ListProperty(long, indexed=False)
+
     def to_jsonable(self):
         return {
             "id": self.key().id(),
             "date_created": self.date_created.isoformat(),
             "date_last_moved": self.date_last_moved.isoformat(),
-            "history": [safe_pickle_loads(h).to_jsonable() for h in self.history],
-            "current_state": safe_pickle_loads(self.current_state).to_jsonable(),
+            "history": [state.to_jsonable() for state in self.get_history_states()],
+            "current_state": self.get_current_state().to_jsonable(),
             "black_cookie": self.black_cookie,
             "white_cookie": self.white_cookie,
-            "chat_history": [safe_pickle_loads(h).to_jsonable() for h in self.chat_history],
+            "chat_history": [entry.to_jsonable() for entry in self.get_chat_entries()],
             "is_finished": self.is_finished,
             "has_scoring_data": self.has_scoring_data,
             "reminder_send_time": self.reminder_send_time.isoformat() if self.reminder_send_time is not None else None,
@@ -1288,10 +2829,19 @@ class Game(db.Model):
     def get_white_player(self):
         return ModelCache.player_by_cookie(self.white_cookie)
 
+    def get_players(self, player=None):
+        # (black, white), fetched together. Pass a player already in hand
+        # to skip fetching it again.
+        players = {}
+        if player is not None:
+            players[player.cookie] = player
+        players.update(ModelCache.players_by_cookies([cookie for cookie in [self.black_cookie, self.white_cookie] if cookie not in players]))
+        return players.get(self.black_cookie), players.get(self.white_cookie)
+
     def get_player_whose_move(self):
         if self.is_finished or self.has_scoring_data:
             return None
-        whose_move = safe_pickle_loads(self.current_state).get_whose_move()
+        whose_move = self.get_current_state().get_whose_move()
         if whose_move == CONST.Black_Color:
             return self.get_black_player()
         else:
@@ -1309,15 +2859,232 @@ class Game(db.Model):
     def get_white_friendly_name(self):
         return self.get_white_player().get_friendly_name()
 
+    def get_current_state(self):
+        # Shared with other requests; clone it before making changes.
+        return GameStateCache.get(self)
+
+    def set_current_state(self, state):
+        self.current_state = db.Blob(dumps_game_state(state))
+        self.scoring_number = state.get_scoring_number()
+        if self.has_key():
+            GameStateCache.replace(self, state)
+
     def get_current_move_number(self):
         # 1.0 shipped with a bug that caused the zeroth state to
         # have current_move_number set to 1. That sorta sucks for history
         # and this little code fixes it. I probably would have ignored the issue
         # but there are over 100 games running on the production site at the moment.
+        return self.get_history_length()
+
+    # Decoded history boards, keyed by (game key, board hash). A hash always
+    # means the same board, so entries never go stale.
+    _history_boards = LRUCache(CONST.History_Board_Cache_Size)
+
+    def put(self, **kwargs):
+        # Writes any history chunks and boards added by append_history along
+        # with the game, then writes the game through to GameCache.
+        entities = self.__dict__.get('_unsaved_entities')
+        if not entities:
+            game_key = db.Model.put(self, **kwargs)
+        else:
+            game_key = db.put([self] + entities.values(), **kwargs)[0]
+            entities.clear()
+        GameCache.written(self)
+        return game_key
+
+    def _get_history_chunks(self, first, last):
+        # Chunks first through last, with any not already in hand fetched
+        # in a single batch. Chunks that don't exist yet come back empty.
+        loaded = self.__dict__.setdefault('_loaded_chunks', {})
+        key_names = [HistoryChunk.key_name_for(i) for i in range(first, last + 1)]
+        missing = [db.Key.from_path(HistoryChunk.kind(), key_name, parent=self.key()) for key_name in key_names if key_name not in loaded]
+        if missing:
+            known_boards = self.__dict__.setdefault('_known_boards', set())
+            for key, chunk in zip(missing, db.get(missing)):
+                if chunk is None:
+                    chunk = HistoryChunk(parent=self, key_name=key.name())
+                for entry in chunk.entries:
+                    reference = decode_board_reference(entry)
+                    if reference is not None:
+                        known_boards.add(reference[0])
+                loaded[key.name()] = chunk
+        return [loaded[key_name] for key_name in key_names]
+
+    def _append_history_entry(self, index, entry):
+        size = CONST.History_Chunk_Size
+        if index % size == 0:
+            chunk = HistoryChunk(parent=self, key_name=HistoryChunk.key_name_for(index // size))
+            self.__dict__.setdefault('_loaded_chunks', {})[chunk.key().name()] = chunk
+        else:
+            chunk = self._get_history_chunks(index // size, index // size)[0]
+        # A put that failed part way may have left entries past the end.
+        del chunk.entries[index % size:]
+        chunk.entries.append(entry)
+        self.__dict__.setdefault('_unsaved_entities', {})[chunk.key().name()] = chunk
+
+    def _replace_history_entry(self, index, entry):
+        # Unlike _append_history_entry, leaves the entries after index alone.
+        size = CONST.History_Chunk_Size
+        chunk = self._get_history_chunks(index // size, index // size)[0]
+        chunk.entries[index % size] = entry
+        self.__dict__.setdefault('_unsaved_entities', {})[chunk.key().name()] = chunk
+
+    def encode_keyframe(self, state, state_blob=None):
+        # The state's own fields plus the hash of its board, which is added
+        # as a BoardPayload unless the game is known to have it already.
+        # States the codec can't split are stored whole.
+        split = split_game_state(state)
+        if split is None:
+            return db.Blob(state_blob if state_blob is not None else dumps_game_state(state))
+        state_fields, payload = split
+        digest = hashlib.sha1(payload).digest()
+        known_boards = self.__dict__.setdefault('_known_boards', set())
+        if digest not in known_boards:
+            known_boards.add(digest)
+            board_payload = BoardPayload(parent=self, key_name=BoardPayload.key_name_for(digest), payload=db.Blob(payload))
+            self.__dict__.setdefault('_unsaved_entities', {})[board_payload.key().name()] = board_payload
+        return db.Blob(encode_board_reference(digest, state_fields))
+
+    def _get_history_boards(self, digests):
+        # Decoded boards for the given hashes; any this instance doesn't have
+        # are fetched in a single batch. Clone before changing them.
+        game_key = str(self.key())
+        unsaved = self.__dict__.get('_unsaved_entities', {})
+        boards = {}
+        missing = []
+        for digest in set(digests):
+            board = Game._history_boards.get((game_key, digest))
+            if board is not None:
+                boards[digest] = board
+            elif BoardPayload.key_name_for(digest) in unsaved:
+                boards[digest] = loads_game_board(unsaved[BoardPayload.key_name_for(digest)].payload)
+            else:
+                missing.append(digest)
+        if missing:
+            keys = [db.Key.from_path(BoardPayload.kind(), BoardPayload.key_name_for(digest), parent=self.key()) for digest in missing]
+            for digest, board_payload in zip(missing, db.get(keys)):
+                board = loads_game_board(board_payload.payload)
+                board.prepare_to_share()
+                Game._history_boards.set((game_key, digest), board)
+                boards[digest] = board
+        return boards
+
+    def _load_keyframe(self, entry, boards):
+        reference = decode_board_reference(entry)
+        if reference is None:
+            return safe_pickle_loads(entry)
+        digest, state_fields = reference
+        return join_game_state(state_fields, boards[digest].clone())
+
+    def move_history_to_chunks(self):
+        # Moves an older game's inline history out to chunks; they are
+        # written on the next put.
+        if self.history_count is None:
+            history = self.history or []
+            self.history = []
+            self.history_count = 0
+            for entry in history:
+                self._append_history_entry(self.history_count, entry)
+                self.history_count += 1
+
+    def get_entities_to_put(self):
+        # The game and any history chunks and boards added since it was
+        # fetched, for callers that batch their own writes.
+        entities = self.__dict__.pop('_unsaved_entities', {})
+        return [self] + entities.values()
+
+    def reencode_history(self):
+        # Rewrites any keyframes that hold a whole state (pickled, or from
+        # before boards were stored separately) with encode_keyframe, moving
+        # older games' history to chunks on the way. Returns the history's
+        # size in bytes, boards included, before and after.
+        self.move_history_to_chunks()
+        length = self.get_history_length()
+        before = 0
+        after = 0
+        for index, entry in enumerate(self.get_history_entries(0, length)):
+            before += len(entry)
+            if decode_history_action(entry) is None and decode_board_reference(entry) is None:
+                new_entry = self.encode_keyframe(safe_pickle_loads(entry))
+                if new_entry != entry:
+                    entry = new_entry
+                    self._replace_history_entry(index, entry)
+            after += len(entry)
+        for entity in self.__dict__.get('_unsaved_entities', {}).values():
+            if isinstance(entity, BoardPayload):
+                after += len(entity.payload)
+        return before, after
+
+    def get_history_length(self):
+        if self.history_count is not None:
+            return self.history_count
         if self.history is None:
             return 0
         return len(self.history)
 
+    def get_history_entries(self, start, stop):
+        if self.archived:
+            return self._get_archive_record()[0][start:stop]
+        if self.history_count is None:
+            return (self.history or [])[start:stop]
+        if stop <= start:
+            return []
+        size = CONST.History_Chunk_Size
+        first = start // size
+        entries = []
+        for chunk in self._get_history_chunks(first, (stop - 1) // size):
+            entries.extend(chunk.entries)
+        return entries[start - first * size:stop - first * size]
+
+    def append_history(self, state_blob, state):
+        # Each history entry is either a keyframe (a whole state, in older
+        # games, or see encode_keyframe) or the action that made it from the
+        # entry before it. See get_history_state.
+        self.move_history_to_chunks()
+        index = self.get_history_length()
+        action = state.get_last_action()
+        if action is None or (index % CONST.History_Keyframe_Interval) == 0:
+            entry = self.encode_keyframe(state, state_blob)
+        else:
+            entry = db.Blob(encode_history_action(action))
+        self._append_history_entry(index, entry)
+        self.history_count = index + 1
+
+    def get_history_state(self, move_number):
+        # Start from the nearest keyframe and replay the actions after it.
+        # That's normally in the same chunk, so this reads just the one.
+        start = move_number - (move_number % CONST.History_Chunk_Size)
+        entries = self.get_history_entries(start, move_number + 1)
+        while decode_history_action(entries[0]) is not None:
+            start -= CONST.History_Chunk_Size
+            entries = self.get_history_entries(start, move_number + 1)
+        keyframe = len(entries) - 1
+        while decode_history_action(entries[keyframe]) is not None:
+            keyframe -= 1
+        reference = decode_board_reference(entries[keyframe])
+        boards = self._get_history_boards([reference[0]] if reference is not None else [])
+        state = self._load_keyframe(entries[keyframe], boards)
+        for entry in entries[keyframe + 1:]:
+            state = state.after_action(decode_history_action(entry))
+        return state
+
+    def get_history_states(self):
+        # Every history state, in order; cheaper than get_history_state for
+        # each one.
+        entries = self.get_history_entries(0, self.get_history_length())
+        references = [decode_board_reference(entry) for entry in entries]
+        boards = self._get_history_boards([reference[0] for reference in references if reference is not None])
+        states = []
+        state = None
+        for entry in entries:
+            action = decode_history_action(entry)
+            if action is None:
+                state = self._load_keyframe(entry, boards)
+            else:
+                state = state.after_action(action)
+            states.append(state)
+        return states
+
     # 1.0 shipped without chat, so some games may not have this.
     # hence this helper routine.
     def get_chat_history_blobs(self):
@@ -1329,12 +3096,100 @@ class Game(db.Model):
             blob_history = None
 
         if blob_history is None:
-            self.chat_history = []
-            self.put()
             blob_history = []
 
         return blob_history
 
+    def _get_older_chat_count(self):
+        # Lines of chat kept before the game's ChatMessages: in chat_history
+        # or, once archived, in the archive.
+        if self.archived:
+            return len(self._get_archive_record()[1])
+        return len(self.get_chat_history_blobs())
+
+    def get_chat_count(self):
+        # Every line of chat the game has; see ChatLog.
+        log = ChatLog.get_by_key_name("chat", parent=self)
+        if log is None:
+            return self._get_older_chat_count()
+        return log.count
+
+    def get_chat_entries(self, start=0, end=None):
+        # ChatEntry objects for every line of chat from start onward, or up
+        # to (but not including) end.
+        start = max(start, 0)
+        if self.archived:
+            entries = [ChatEntry(*line) for line in self._get_archive_record()[1][start:end]]
+        else:
+            entries = [safe_pickle_loads(blob) for blob in self.get_chat_history_blobs()[start:end]]
+        query = ChatMessage.all().ancestor(self).filter("__key__ >=", ChatMessage.key_for(self.key(), max(start, self._get_older_chat_count())))
+        if end is not None:
+            if end <= start:
+                return entries
+            query.filter("__key__ <", ChatMessage.key_for(self.key(), end))
+        entries.extend([message.get_chat_entry() for message in query.order("__key__")])
+        return entries
+
+    def append_chat(self, entry):
+        # Only the new line and the game's ChatLog are written; the game
+        # itself isn't touched.
+        def txn():
+            log = ChatLog.get_by_key_name("chat", parent=self)
+            if log is None:
+                log = ChatLog(parent=self, key_name="chat", count=self._get_older_chat_count())
+            message = ChatMessage(key=ChatMessage.key_for(self.key(), log.count), cookie=entry.get_cookie(), message=entry.get_message(), move_number=entry.get_move_number())
+            log.count += 1
+            db.put([log, message])
+        db.run_in_transaction(txn)
+
+    def _get_archive_record(self):
+        # (history entries, chat lines, final state), fetched once.
+        record = self.__dict__.get('_archive_record')
+        if record is None:
+            archive = GameArchive.get_by_key_name("archive", parent=self)
+            record = GameArchive.decode_record(archive.record)
+            self.__dict__['_archive_record'] = record
+        return record
+
+    def archive(self):
+        # Moves a finished game's history, chat and final state into one
+        # compressed GameArchive and deletes the children they came from,
+        # along with the inline lists older games carry. The game entity
+        # keeps its current_state, so the game page doesn't need the
+        # archive. Call from a transaction on a freshly fetched game.
+        # Returns the bytes stored before and after.
+        payloads = dict((board_payload.key().name(), board_payload.payload) for board_payload in BoardPayload.all().ancestor(self))
+        before = sum(len(payload) for payload in payloads.values())
+        history = []
+        for entry in self.get_history_entries(0, self.get_history_length()):
+            before += len(entry)
+            reference = decode_board_reference(entry)
+            if reference is not None:
+                digest, state_fields = reference
+                entry = _State_Codec_Magic + state_fields + payloads[BoardPayload.key_name_for(digest)]
+            history.append(str(entry))
+        chat = []
+        for entry in self.get_chat_entries():
+            before += len(entry.get_message())
+            chat.append((entry.get_cookie(), entry.get_message(), entry.get_move_number()))
+        archive = GameArchive(parent=self, key_name="archive", record=db.Blob(GameArchive.encode_record(history, chat, str(self.current_state))))
+
+        children = []
+        for model_class in [HistoryChunk, BoardPayload, ChatMessage, ChatLog]:
+            children.extend(model_class.all(keys_only=True).ancestor(self))
+        self.history = []
+        self.history_count = len(history)
+        self.chat_history = []
+        self.position_hashes = []
+        self.__dict__.pop('_seen_positions', None)
+        self.archived = True
+        for name in ['_unsaved_entities', '_loaded_chunks', '_known_boards']:
+            self.__dict__.pop(name, None)
+        self.__dict__['_archive_record'] = (history, chat, str(self.current_state))
+        db.put([self, archive])
+        db.delete(children)
+        return before, len(archive.record)
+
     def get_reminder_send_time(self):
         __reminder_send_time = None
         try:
@@ -1343,6 +3198,46 @@ class Game(db.Model):
             __reminder_send_time
         return __reminder_send_time
 
+    def uses_superko(self):
+        # Games created before superko existed don't have the property.
+        try:
+            return bool(self.superko)
+        except:
+            return False
+
+    def _get_seen_positions(self):
+        # position_hashes as a set, built once per instance and then kept
+        # in step by remember_position.
+        seen = self.__dict__.get('_seen_positions')
+        if seen is None:
+            seen = self.__dict__['_seen_positions'] = set(self.position_hashes)
+        return seen
+
+    def has_seen_position(self, position_hash):
+        return position_hash in self._get_seen_positions()
+
+    def remember_position(self, position_hash):
+        if self.uses_superko() and not self.has_seen_position(position_hash):
+            self.position_hashes.append(long(position_hash))
+            self._get_seen_positions().add(long(position_hash))
+
+    def get_ko_position_hash(self, state):
+        # The position before state, which the next move may not recreate.
+        # Older states don't know its hash, so look it up in the history.
+        position_hash = state.get_previous_position_hash()
+        if position_hash is None and self.get_history_length() > 0:
+            position_hash = self.get_history_state(self.get_history_length() - 1).get_board().get_position_hash()
+        return position_hash
+
+    def get_forbidden_position_hashes(self, state):
+        forbidden = set()
+        ko_position_hash = self.get_ko_position_hash(state)
+        if ko_position_hash is not None:
+            forbidden.add(ko_position_hash)
+        if self.uses_superko():
+            forbidden.update(self._get_seen_positions())
+        return forbidden
+
     def dont_remind_for_long_time(self):
         self.reminder_send_time = datetime.now() + timedelta(weeks=52)
         self.put()
@@ -1358,6 +3253,10 @@ class Game(db.Model):
 # have to go back and fix all the old player objects.
 
 class Player(db.Model):
+    # Keyed by cookie; see key_name_for. Older players have numeric ids
+    # until rekey moves them over, and are found by the cookie query
+    # get_by_cookie falls back to, so cookie stays indexed (db won't filter
+    # on an unindexed property at all).
     game = db.ReferenceProperty(Game)
     cookie = db.StringProperty()
     color = db.IntegerProperty(default=CONST.No_Color)
@@ -1369,9 +3268,44 @@ class Player(db.Model):
     contact_type = db.StringProperty(default=CONST.Email_Contact)
     show_grid = db.BooleanProperty(default=False)
 
+    @staticmethod
+    def key_name_for(cookie):
+        return "p" + cookie
+
+    @staticmethod
+    def get_by_cookie(cookie):
+        player = Player.get_by_key_name(Player.key_name_for(cookie))
+        if player is None:
+            player = Player.get_unkeyed_by_cookie(cookie)
+        return player
+
+    @staticmethod
+    def get_unkeyed_by_cookie(cookie):
+        # An older player, moved to its cookie key on the way out.
+        player = Player.all().filter("cookie =", cookie).get()
+        if player is not None:
+            player = Player.rekey(player)
+        return player
+
+    @staticmethod
+    def rekey(player):
+        # Copies a player with a numeric id to its cookie key and deletes
+        # the original. Returns the copy.
+        def txn():
+            keyed = Player.get_by_key_name(Player.key_name_for(player.cookie))
+            if keyed is None:
+                values = dict((name, prop.get_value_for_datastore(player)) for name, prop in Player.properties().items())
+                keyed = Player(key_name=Player.key_name_for(player.cookie), **values)
+                keyed.put()
+            db.delete(player.key())
+            return keyed
+        keyed = db.run_in_transaction_options(db.create_transaction_options(xg=True), txn)
+        ModelCache.clear_cookie(player.cookie)
+        return keyed
+
     def to_jsonable(self):
         return {
-            "id": self.key().id(),
+            "id": self.key().id_or_name(),
             "game_id": self.game.key().id(),
             "cookie": self.cookie,
             "color": self.color,
@@ -1411,12 +3345,16 @@ class Player(db.Model):
             return ""
         return safe_twitter
 
+    def get_game(self):
+        # Prefer this to self.game, which always goes to the datastore.
+        return GameCache.get(Player.game.get_value_for_datastore(self))
+
     def get_opponent(self):
         opponent_color = opposite_color(self.color)
         if opponent_color == CONST.Black_Color:
-            return self.game.get_black_player()
+            return self.get_game().get_black_player()
         else:
-            return self.game.get_white_player()
+            return self.get_game().get_white_player()
 
     def get_friendly_name(self):
         friendly_name = self.name
@@ -1478,6 +3416,13 @@ class GoHandler(webapp2.RequestHandler):
         self.response.headers['Content-Type'] = 'application/json'
         self.response.out.write(simplejson.dumps(obj))
 
+    def get_player(self, cookie):
+        # The player for a cookie from the request; see CookieLimiter.
+        if not cookie or len(cookie) > CONST.Max_Cookie_Length:
+            return None
+        limiter = CookieLimiter(str(self.request.remote_addr), cookie)
+        return ModelCache.player_by_cookie(cookie, limiter)
+
     def render_json_as_text(self, obj):
         self.response.headers['Content-Type'] = 'text/plain'
         self.response.out.write(simplejson.dumps(obj))
@@ -1582,7 +3527,7 @@ class CreateGameHandler(GoHandler):
     def require_twitter_password(self, flash):
         self.render_json({'success': True, 'need_your_twitter_password': True, 'flash': flash})
 
-    def create_game(self, your_name, your_contact, your_contact_type, opponent_name, opponent_contact, opponent_contact_type, your_color, board_size_index, handicap_index, komi_index):
+    def create_game(self, your_name, your_contact, your_contact_type, opponent_name, opponent_contact, opponent_contact_type, your_color, board_size_index, handicap_index, komi_index, superko=False):
         # Create cookies for accessing the game
         your_cookie, opponent_cookie = GameCookie.unique_pair()
 
@@ -1597,9 +3542,10 @@ class CreateGameHandler(GoHandler):
         game.date_created = datetime.now()
         game.date_last_moved = datetime.now()
         game.reminder_send_time = datetime.now()
-        game.history = [] # unused value to make appengine happy
-        game.chat_history = []
-        game.current_state = db.Blob(pickle.dumps(state))
+        game.history_count = 0
+        game.set_current_state(state)
+        game.superko = superko
+        game.remember_position(board.get_position_hash())
         if your_color == CONST.Black_Color:
             game.black_cookie = your_cookie
             game.white_cookie = opponent_cookie
@@ -1614,7 +3560,7 @@ class CreateGameHandler(GoHandler):
         game_key = game.put()
 
         # Create your player
-        your_player = Player()
+        your_player = Player(key_name=Player.key_name_for(your_cookie))
         your_player.game = game_key
         your_player.cookie = your_cookie
         your_player.color = your_color
@@ -1634,7 +3580,7 @@ class CreateGameHandler(GoHandler):
             your_twitter = your_contact
 
         # Create opponent player
-        opponent_player = Player()
+        opponent_player = Player(key_name=Player.key_name_for(opponent_cookie))
         opponent_player.game = game_key
         opponent_player.cookie = opponent_cookie
         opponent_player.color = opposite_color(your_color)
@@ -1653,9 +3599,11 @@ class CreateGameHandler(GoHandler):
             opponent_player.wants_twitter = True
             opponent_twitter = opponent_contact
 
-        # Put the players
+        # Put the players, and forget any earlier lookups of their cookies
         your_player.put()
         opponent_player.put()
+        ModelCache.clear_cookie(your_cookie)
+        ModelCache.clear_cookie(opponent_cookie)
 
         # Send out notification to both players, using desired notification scheme.
         if your_player.wants_email:
@@ -1695,6 +3643,9 @@ class CreateGameHandler(GoHandler):
         except:
             your_twitter_password = None
 
+        # Optional: positional superko instead of the simple rule of Ko.
+        superko = (self.request.POST.get("superko") == "true")
+
         if (your_color < CONST.Black_Color) or (your_color > CONST.White_Color):
             self.fail("Invalid color.")
             return
@@ -1768,7 +3719,7 @@ class CreateGameHandler(GoHandler):
             # success -- opponent is following @davepeckgo
 
         try:
-            your_cookie, your_turn = self.create_game(your_name, your_contact, your_contact_type, opponent_name, opponent_contact, opponent_contact_type, your_color, board_size_index, handicap_index, komi_index)
+            your_cookie, your_turn = self.create_game(your_name, your_contact, your_contact_type, opponent_name, opponent_contact, opponent_contact_type, your_color, board_size_index, handicap_index, komi_index, superko)
             self.success(your_cookie, your_turn)
         except:
             logging.error("An unexpected error occured in CreateGameHandler: %s" % ExceptionHelper.exception_string())
@@ -1793,22 +3744,20 @@ class PlayGameHandler(GoHandler):
         self.render_template("fail.html", {'message': message})
 
     def get(self, cookie, *args):
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("No game with that ID could be found.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Found a reference to a player, but couldn't find the game. Try again in a few minutes?")
             return
 
-        black_player = ModelCache.player_by_cookie(game.black_cookie)
-        white_player = ModelCache.player_by_cookie(game.white_cookie)
-
-        opponent_player = player.get_opponent()
+        black_player, white_player = game.get_players(player)
+        opponent_player = white_player if player.color == CONST.Black_Color else black_player
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         your_move = (state.whose_move == player.color)
         board = state.get_board()
         you_are_done_scoring = state.is_done_scoring(player.color)
@@ -1893,12 +3842,12 @@ class MakeThisMoveHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: found the player but not the game.")
             return
@@ -1907,7 +3856,7 @@ class MakeThisMoveHandler(GoHandler):
             self.fail("No more moves can be made; the game is finished.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         if state.whose_move != player.color:
             self.fail("Sorry, but it is not your turn.")
             return
@@ -1942,67 +3891,35 @@ class MakeThisMoveHandler(GoHandler):
             self.fail("You can't move here; there is already a stone!")
             return
 
-        # Create the potentially new state
-        new_state = state.clone()
-        new_state.increment_current_move_number()
-        new_state.set_whose_move(opposite_color(player.color))
-        new_state.set_last_move_was_pass(False)
+        # Create the potentially new state: place the stone, then capture
+        # and count whatever it captures.
+        new_state = state.after_move(move_x, move_y, player.color)[0]
         new_board = new_state.get_board()
-        new_board.set(move_x, move_y, player.color)
-
-        # Deal with captures and (new) ataris
-        move_message = "It's your turn to move"
-        ataris, captures = new_board.compute_atari_and_captures(move_x, move_y)
-        if ataris > 0:
-            if ataris == 1:
-                move_message += "; you were just placed in atari"
-            else:
-                move_message += "; you were just placed in double atari"
-
-        if len(captures) > 0:
-            if ataris == 0:
-                move_message += ";"
-            else:
-                move_message += " and"
-            if len(captures) == 1:
-                move_message += " one of your stones was captured"
-            else:
-                move_message += " %d of your stones were captured" % len(captures)
-
-            # actually capture the stones
-            for x, y in captures:
-                new_board.set(x, y, CONST.No_Color)
-
-            # and count the captures
-            if player.color == CONST.Black_Color:
-                new_state.set_white_stones_captured(new_state.get_white_stones_captured() + len(captures))
-            else:
-                new_state.set_black_stones_captured(new_state.get_black_stones_captured() + len(captures))
+        move_message = new_state.get_last_move_message()
 
         # okay, now that we've handled captures, do we have a situation where this move would be suicidal?
         if new_board.is_stone_in_suicide(move_x, move_y):
             self.fail("You can't move there; your stone would immediately be captured!")
             return
 
-        move_message += "."
-
-        new_state.set_last_move_message(move_message)
-        new_state.set_last_move(move_x, move_y)
         new_state_string = new_board.get_state_string()
 
-        # Enforce the rule of Ko. If the new state is the same as the last history
+        # Enforce the rule of Ko. If the new position is the same as the last history
         # state (aka two moves back, since we haven't yet appended) then you've
-        # violated Ko.
-        if len(game.history) > 0:
-            two_back_state = safe_pickle_loads(game.history[-1])
-            two_back_board = two_back_state.get_board()
-            two_back_state_string = two_back_board.get_state_string()
-            if two_back_state_string == new_state_string:
-                self.fail("Sorry, but this move would violate the <a href=\"http://www.samarkand.net/Academy/learn_go/learn_go_pg8.html\">rule of Ko</a>. Move somewhere else and try playing here later!")
-                return
+        # violated Ko. Older states don't know that position's hash, so look it up.
+        new_position_hash = new_board.get_position_hash()
+        if game.get_ko_position_hash(state) == new_position_hash:
+            self.fail("Sorry, but this move would violate the <a href=\"http://www.samarkand.net/Academy/learn_go/learn_go_pg8.html\">rule of Ko</a>. Move somewhere else and try playing here later!")
+            return
 
-        game.history.append(game.current_state)
-        game.current_state = db.Blob(pickle.dumps(new_state))
+        if game.uses_superko() and game.has_seen_position(new_position_hash):
+            self.fail("Sorry, but this move would repeat an earlier board position, which isn't allowed in this game. Move somewhere else!")
+            return
+
+        game.remember_position(new_position_hash)
+
+        game.append_history(game.current_state, state)
+        game.set_current_state(new_state)
         game.date_last_moved = datetime.now()
         game.reminder_send_time = datetime.now()
 
@@ -2046,17 +3963,17 @@ class PassHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: found the player but not the game.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         if state.whose_move != player.color:
             self.fail("Sorry, but it is not your turn.")
             return
@@ -2073,29 +3990,16 @@ class PassHandler(GoHandler):
             return
 
         # Create the potentially new state
-        new_state = state.clone()
+        new_state = state.after_pass(player.color)
         new_board = new_state.get_board()
-
-        new_state.increment_current_move_number()
-        new_state.set_whose_move(opposite_color(player.color))
-        new_state.set_last_move_was_pass(True)
+        move_message = new_state.get_last_move_message()
 
         previous_also_passed = state.get_last_move_was_pass()
-
         if previous_also_passed:
-            move_message = "Mark the dead stones. Click done when finished. When you and your opponent agree, the game will end."
-
             game.has_scoring_data = True
-            new_state.increment_scoring_number()
 
-            new_board.mark_territory()
-            new_state.count_territory()
-        else:
-            move_message = "Your opponent passed. You can make a move, or you can pass again to end the game."
-        new_state.set_last_move_message(move_message)
-
-        game.history.append(game.current_state)
-        game.current_state = db.Blob(pickle.dumps(new_state))
+        game.append_history(game.current_state, state)
+        game.set_current_state(new_state)
         game.date_last_moved = datetime.now()
         game.reminder_send_time = datetime.now()
 
@@ -2139,12 +4043,12 @@ class MarkStoneHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: found the player but not the game.")
             return
@@ -2157,7 +4061,7 @@ class MarkStoneHandler(GoHandler):
             self.fail("Scoring is not allowed yet; the game is still in progress.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
 
         if state.is_done_scoring(player.color):
             self.fail("Sorry, but you have already finished scoring.")
@@ -2205,14 +4109,10 @@ class MarkStoneHandler(GoHandler):
             self.fail("Unexpected error: marking stone had no effect.")
             return
 
-        for x, y in stones:
-            new_board.set_owner(x, y, owner)
-
-        new_board.mark_territory()
-        new_state.count_territory()
+        new_state.mark_stones(stones, owner)
 
         # Replace the current game state.
-        game.current_state = db.Blob(pickle.dumps(new_state))
+        game.set_current_state(new_state)
         game.reminder_send_time = datetime.now()
         new_state_string = new_board.get_state_string()
 
@@ -2262,12 +4162,12 @@ class DoneHandler(GoHandler):
             self.fail()
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: found the player but not the game.")
             return
@@ -2278,7 +4178,7 @@ class DoneHandler(GoHandler):
             self.fail("The game has not started scoring yet.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         if state.is_done_scoring(player.color):
             self.fail("You have already finished scoring.")
             return
@@ -2307,7 +4207,7 @@ class DoneHandler(GoHandler):
                 new_state.set_winner(CONST.Black_Color)
 
         game.reminder_send_time = datetime.now()
-        game.current_state = db.Blob(pickle.dumps(new_state))
+        game.set_current_state(new_state)
 
         try:
             game.put()
@@ -2364,17 +4264,17 @@ class ResignHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: found the player but not the game.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         if state.whose_move != player.color:
             self.fail("Sorry, but it is not your turn.")
             return
@@ -2391,18 +4291,12 @@ class ResignHandler(GoHandler):
             return
 
         # Create the potentially new state
-        new_state = state.clone()
-        new_state.increment_current_move_number()
-        new_state.set_whose_move(opposite_color(player.color))
-        new_state.set_last_move_was_pass(True)
-
-        move_message = "The game is over!"
+        new_state = state.after_resign(player.color)
+        move_message = new_state.get_last_move_message()
         game.is_finished = True
-        new_state.set_winner(opposite_color(player.color))
-        new_state.set_last_move_message(move_message)
 
-        game.history.append(game.current_state)
-        game.current_state = db.Blob(pickle.dumps(new_state))
+        game.append_history(game.current_state, state)
+        game.set_current_state(new_state)
         game.date_last_moved = datetime.now()
         game.reminder_send_time = datetime.now()
 
@@ -2444,17 +4338,17 @@ class HasOpponentMovedHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: no game found.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
         if state.whose_move != player.color:
             self.render_json({'success': True, 'flash': 'OK', 'has_opponent_moved': False})
         else:
@@ -2481,6 +4375,46 @@ class HasOpponentMovedHandler(GoHandler):
                 'game_is_scoring': game.is_scoring(),
                 'game_is_finished': game.is_finished})
 
+#------------------------------------------------------------------------------
+# "Legal Moves" Handler
+#------------------------------------------------------------------------------
+
+class LegalMovesHandler(GoHandler):
+    def fail(self, message):
+        self.render_json({'success': False, 'flash': message})
+
+    def post(self, *args):
+        cookie = self.request.POST.get("your_cookie")
+        if not cookie:
+            self.fail("Unexpected error: no cookie found.")
+            return
+
+        player = self.get_player(cookie)
+        if not player:
+            self.fail("Unexpected error: invalid player.")
+            return
+
+        game = player.get_game()
+        if not game:
+            self.fail("Unexpected error: no game found.")
+            return
+
+        if not game.in_progress():
+            self.fail("No moves can be made; the game is not in progress.")
+            return
+
+        state = game.get_current_state()
+        if state.whose_move != player.color:
+            self.fail("Sorry, but it is not your turn.")
+            return
+
+        board = state.get_board()
+        self.render_json({
+            'success': True,
+            'flash': 'OK',
+            'current_move_number': game.get_current_move_number(),
+            'legal_moves': board.compute_legal_moves(player.color, game.get_forbidden_position_hashes(state))})
+
 #------------------------------------------------------------------------------
 # "Has Opponent Scored" Handler
 #------------------------------------------------------------------------------
@@ -2495,12 +4429,12 @@ class HasOpponentScoredHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: no game found.")
             return
@@ -2515,7 +4449,7 @@ class HasOpponentScoredHandler(GoHandler):
             self.fail("Unexpected error: invalid scoring request")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
 
         if state.get_scoring_number() == base_scoring_number and not game.is_finished:
             self.render_json({'success': True, 'flash': 'OK', 'has_opponent_scored': False})
@@ -2547,7 +4481,7 @@ class OptionsHandler(GoHandler):
         self.render_template("fail.html", {'message': message})
 
     def get(self, cookie, *args):
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("No game with that ID could be found.")
             return
@@ -2656,7 +4590,7 @@ class ChangeOptionsHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
@@ -2703,7 +4637,7 @@ class ChangeGridOptionsHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
@@ -2747,7 +4681,7 @@ class RecentChatHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
@@ -2762,21 +4696,22 @@ class RecentChatHandler(GoHandler):
             self.fail("Unexpected error: try refreshing your browser window.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: couldn't find game for player.")
             return
 
-        blob_history = game.get_chat_history_blobs()
-        recent_blobs = blob_history[last_chat_seen:]
-        # no longer desirable -- recent_blobs.reverse()
+        # Count first: lines added after it wait for the next poll.
+        chat_count = game.get_chat_count()
+        recent_entries = game.get_chat_entries(last_chat_seen, chat_count)
+        # no longer desirable -- recent_entries.reverse()
         recent_chats = []
 
-        for blob in recent_blobs:
-            entry = safe_pickle_loads(blob)
-            recent_chats.append({'name': entry.get_player_friendly_name(), 'message': entry.get_message(), 'move_number': entry.get_move_number()})
+        players = ModelCache.players_by_cookies([entry.get_cookie() for entry in recent_entries])
+        for entry in recent_entries:
+            recent_chats.append({'name': players[entry.get_cookie()].get_friendly_name(), 'message': entry.get_message(), 'move_number': entry.get_move_number()})
 
-        self.render_json({'success': True, 'flash': 'OK', 'chat_count': len(blob_history), 'recent_chats': recent_chats})
+        self.render_json({'success': True, 'flash': 'OK', 'chat_count': chat_count, 'recent_chats': recent_chats})
 
 
 #------------------------------------------------------------------------------
@@ -2793,17 +4728,17 @@ class AddChatHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: couldn't find game for player.")
             return
 
-        state = safe_pickle_loads(game.current_state)
+        state = game.get_current_state()
 
         # Message, etc.
         message = self.request.POST.get("message")
@@ -2832,26 +4767,20 @@ class AddChatHandler(GoHandler):
             self.fail("Unexpected error: try refreshing your browser window.")
             return
 
-        # force game to have chat history
-        blob_history = game.get_chat_history_blobs()
         entry = ChatEntry(cookie, clean_message, state.get_current_move_number())
-        blob_history.append(db.Blob(pickle.dumps(entry)))
-        game.chat_history = blob_history
-
-        try:
-            game.put()
-        except:
-            game.put()
+        game.append_chat(entry)
 
-        recent_blobs = blob_history[last_chat_seen:]
-        # no longer desirable -- recent_blobs.reverse()
+        # Count first: lines added after it wait for the next poll.
+        chat_count = game.get_chat_count()
+        recent_entries = game.get_chat_entries(last_chat_seen, chat_count)
+        # no longer desirable -- recent_entries.reverse()
         recent_chats = []
 
-        for blob in recent_blobs:
-            entry = safe_pickle_loads(blob)
-            recent_chats.append({'name': entry.get_player_friendly_name(), 'message': entry.get_message(), 'move_number': entry.get_move_number()})
+        players = ModelCache.players_by_cookies([entry.get_cookie() for entry in recent_entries])
+        for entry in recent_entries:
+            recent_chats.append({'name': players[entry.get_cookie()].get_friendly_name(), 'message': entry.get_message(), 'move_number': entry.get_move_number()})
 
-        self.render_json({'success': True, 'flash': 'OK', 'chat_count': len(blob_history), 'recent_chats': recent_chats})
+        self.render_json({'success': True, 'flash': 'OK', 'chat_count': chat_count, 'recent_chats': recent_chats})
 
 
 #------------------------------------------------------------------------------
@@ -2866,18 +4795,17 @@ class HistoryHandler(GoHandler):
         self.get_move(cookie)
 
     def get_move(self, cookie, move=None):
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("No game with that ID could be found.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Found a reference to a player, but couldn't find the game. Try again in a few minutes?")
             return
 
-        black_player = ModelCache.player_by_cookie(game.black_cookie)
-        white_player = ModelCache.player_by_cookie(game.white_cookie)
+        black_player, white_player = game.get_players(player)
 
         # XXX this appears unused
         # if player.color == CONST.Black_Color:
@@ -2892,14 +4820,12 @@ class HistoryHandler(GoHandler):
             except:
                 move_number = None
 
-        max_move_number = len(game.history)
-        requested_state = None
+        max_move_number = game.get_history_length()
         if move_number is None or move_number >= max_move_number or move_number < 0:
-            requested_state = game.current_state
+            state = game.get_current_state()
         else:
-            requested_state = game.history[move_number]
+            state = game.get_history_state(move_number)
 
-        state = safe_pickle_loads(requested_state)
         # XXX this appears unused your_move = (state.whose_move == player.color)
         board = state.get_board()
 
@@ -2952,12 +4878,12 @@ class GetHistoricalStateHandler(GoHandler):
             self.fail("Unexpected error: no cookie found.")
             return
 
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             self.fail("Unexpected error: invalid player.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             self.fail("Unexpected error: no game found.")
             return
@@ -2971,17 +4897,15 @@ class GetHistoricalStateHandler(GoHandler):
             self.fail("Unexpected error: must specify a move number.")
             return
 
-        requested_state = None
-        max_move_number = len(game.history)
+        max_move_number = game.get_history_length()
         if move_number >= max_move_number:
-            requested_state = game.current_state
+            state = game.get_current_state()
         elif (move_number >= 0) and (move_number < max_move_number):
-            requested_state = game.history[move_number]
+            state = game.get_history_state(move_number)
         else:
             self.fail("Unexpected error: move number is out of range.")
             return
 
-        state = safe_pickle_loads(requested_state)
 
         board = state.get_board()
         last_move_x, last_move_y = state.get_last_move()
@@ -3009,22 +4933,21 @@ class SGFHandler(GoHandler):
         self.render_template("fail.html", {'message': message})
 
     def get(self, cookie, *args):
-        player = ModelCache.player_by_cookie(cookie)
+        player = self.get_player(cookie)
         if not player:
             # XXX Should 404.
             self.fail("No game with that ID could be found.")
             return
 
-        game = player.game
+        game = player.get_game()
         if not game:
             # XXX Should 500?
             self.fail("Found a reference to a player, but couldn't find the game. Try again in a few minutes?")
             return
 
-        black_player = ModelCache.player_by_cookie(game.black_cookie)
-        white_player = ModelCache.player_by_cookie(game.white_cookie)
+        black_player, white_player = game.get_players(player)
 
-        current_state = safe_pickle_loads(game.current_state)
+        current_state = game.get_current_state()
         board = current_state.get_board()
 
         handicap = board.get_handicap()
@@ -3032,15 +4955,15 @@ class SGFHandler(GoHandler):
         handicap_stones = [pos_to_coord(positions_handicap[i]) for i in range(board.get_handicap())]
 
         # Build a dict of all the games chat messages.
-        chat_blobs = game.get_chat_history_blobs()
         chats = {}
-        for blob in chat_blobs:
-            entry = safe_pickle_loads(blob)
+        chat_entries = game.get_chat_entries()
+        chat_players = ModelCache.players_by_cookies([entry.get_cookie() for entry in chat_entries])
+        for entry in chat_entries:
             move = entry.get_move_number()
             if move <= 0:
                 move = 1
             move_chats = chats.get(move, [])
-            move_chats.append("%s: %s" % (entry.get_player_friendly_name(), entry.get_message()))
+            move_chats.append("%s: %s" % (chat_players[entry.get_cookie()].get_friendly_name(), entry.get_message()))
             chats[move] = move_chats
 
         moves = []
@@ -3049,11 +4972,11 @@ class SGFHandler(GoHandler):
         # Iterate over the history, constructing SGF move strings.
         # Skip the first history state (the initial board, no move)
         # Make sure the current state is at the end.
-        game.history.append(game.current_state)
+        states = game.get_history_states()
+        states.append(current_state)
         # Ensure we have the first move
-        whose_move = safe_pickle_loads(game.history[0]).get_whose_move()
-        for pstate in game.history[1:]:
-            state = safe_pickle_loads(pstate)
+        whose_move = states[0].get_whose_move()
+        for state in states[1:]:
 
             # Set the move number, if necessary.
             if state.get_current_move_number() != move_number + 1:
@@ -3157,6 +5080,8 @@ class EnsureReminderTimesHandler(GoHandler):
                         db.put(games_to_write)
                     except:
                         db.put(games_to_write)
+                    for game in games_to_write:
+                        GameCache.written(game)
 
                 self.render_json({'success': True, 'amount_found': amount_found, 'amount_modified': len(games_to_write), 'new_last_id': new_last_id})
         except:
@@ -3175,7 +5100,7 @@ class SendRemindersHandler(GoHandler):
         try:
             one_week_ago = datetime.now() - timedelta(weeks=1)
             two_months_ago = datetime.now() - timedelta(weeks=8)
-            stale_game = db.GqlQuery("SELECT * FROM Game WHERE reminder_send_time < :1", one_week_ago).get()
+            stale_game = db.GqlQuery("SELECT * FROM Game WHERE is_finished = False AND reminder_send_time < :1", one_week_ago).get()
             if (stale_game is None):
                 message = "No stale games to remind about."
             else:
@@ -3206,7 +5131,7 @@ class SendRemindersHandler(GoHandler):
                         for player in players:
                             if player.wants_email:
                                 opponent = player.get_opponent()
-                                state = safe_pickle_loads(stale_game.current_state)
+                                state = stale_game.get_current_state()
                                 EmailHelper.remind_player(player.get_friendly_name(), player.email, player.cookie, opponent.get_friendly_name(), state.get_current_move_number(), stale_game.is_scoring())
                                 message = "Sent an email reminder to %s about game %s!" % (player.email, player.cookie)
                             elif player.does_want_twitter():
@@ -3224,6 +5149,340 @@ class SendRemindersHandler(GoHandler):
 
 
 
+#------------------------------------------------------------------------------
+# Mappers: resumable batch jobs over every entity of a kind
+#------------------------------------------------------------------------------
+
+class Mapper(object):
+    # Visits every model_class entity in key order, batch_size at a time,
+    # writing back whatever map returns. run does at least one batch, stops
+    # once time_budget seconds have gone by and hands back a cursor to carry
+    # on from (None when it's done); RunMapperHandler keeps calling it, either by chaining tasks or
+    # at the request of the update-database page. map must be safe to run
+    # twice on the same entity, since a batch that times out is redone.
+    model_class = None
+
+    def __init__(self, batch_size=10, time_budget=20.0):
+        super(Mapper, self).__init__()
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.counters = {'found': 0, 'modified': 0, 'failed': 0}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def query(self):
+        # Subclasses can filter this; run orders it by key.
+        return self.model_class.all()
+
+    def map(self, entity):
+        # Returns the entities to put; none if nothing changed.
+        return []
+
+    def run(self, cursor=None):
+        start = time.time()
+        while True:
+            query = self.query().order('__key__')
+            if cursor is not None:
+                query.with_cursor(cursor)
+            entities = query.fetch(self.batch_size)
+            if not entities:
+                return None
+            to_put = []
+            for entity in entities:
+                self.count('found')
+                try:
+                    changed = self.map(entity)
+                except Exception:
+                    self.count('failed')
+                    logging.error("Mapper %s failed on %s: %s" % (self.__class__.__name__, entity.key(), ExceptionHelper.exception_string()))
+                    continue
+                if changed:
+                    self.count('modified')
+                    to_put.extend(changed)
+            if to_put:
+                try:
+                    db.put(to_put)
+                except:
+                    db.put(to_put)
+                for entity in to_put:
+                    if isinstance(entity, Game):
+                        GameCache.written(entity)
+            cursor = query.cursor()
+            if len(entities) < self.batch_size:
+                return None
+            if time.time() - start >= self.time_budget:
+                return cursor
+
+class ReencodeGamesMapper(Mapper):
+    # Rewrites each game's current state and history keyframes with
+    # dumps_game_state, moving older games' history out to chunks.
+    model_class = Game
+
+    def map(self, game):
+        if game.archived:
+            return []
+        changed = game.history_count is None
+        before = len(game.current_state)
+        if not game.current_state.startswith(_State_Codec_Magic):
+            game.set_current_state(game.get_current_state())
+            changed = True
+        after = len(game.current_state)
+
+        history_before, history_after = game.reencode_history()
+        self.count('bytes_before', before + history_before)
+        self.count('bytes_after', after + history_after)
+        entities = game.get_entities_to_put()
+        if not changed and len(entities) == 1:
+            return []
+        return entities
+
+class ArchiveFinishedGamesMapper(Mapper):
+    # Archives each game that finished a while ago; see Game.archive. Each
+    # game is archived in its own transaction, so map writes nothing itself.
+    model_class = Game
+
+    def query(self):
+        return Game.all().filter('is_finished =', True)
+
+    def map(self, game):
+        if game.archived or game.date_last_moved > datetime.now() - timedelta(days=CONST.Archive_Finished_Games_After_Days):
+            return []
+
+        def txn():
+            fresh_game = Game.get(game.key())
+            if fresh_game.archived:
+                return None
+            return fresh_game.archive()
+
+        sizes = db.run_in_transaction(txn)
+        GameCache.forget(game.key())
+        if sizes is not None:
+            self.count('archived')
+            self.count('bytes_before', sizes[0])
+            self.count('bytes_after', sizes[1])
+        return []
+
+class KeyPlayersByCookieMapper(Mapper):
+    # Moves every player that still has a numeric id to its cookie key, so
+    # that lookups never need to fall back to the cookie query.
+    model_class = Player
+
+    def map(self, player):
+        if player.key().name() is None:
+            Player.rekey(player)
+            self.count('rekeyed')
+        return []
+
+Mapper_Jobs = {
+    'reencode-games': ReencodeGamesMapper,
+    'archive-finished-games': ArchiveFinishedGamesMapper,
+    'key-players-by-cookie': KeyPlayersByCookieMapper,
+}
+
+class RunMapperHandler(GoHandler):
+    def get(self, *args):
+        # So cron can start a chained run.
+        self.post(*args)
+
+    def post(self, *args):
+        try:
+            job = self.request.get('job')
+            mapper_class = Mapper_Jobs[job]
+            batch_size = int(self.request.get('batch_size', 10))
+            time_budget = float(self.request.get('time_budget', 20))
+            cursor = self.request.get('cursor') or None
+            chain = bool(self.request.get('chain'))
+            totals = simplejson.loads(self.request.get('totals') or '{}')
+
+            mapper = mapper_class(batch_size, time_budget)
+            cursor = mapper.run(cursor)
+            for name, amount in mapper.counters.items():
+                totals[name] = totals.get(name, 0) + amount
+
+            if chain:
+                logging.info("Mapper %s: %r" % (job, totals))
+                if cursor is not None:
+                    taskqueue.add(url='/cron/run-mapper/', params={'job': job, 'batch_size': batch_size, 'time_budget': time_budget, 'cursor': cursor, 'chain': 1, 'totals': simplejson.dumps(totals)})
+        except:
+            self.render_json({'success': False, 'Error': ExceptionHelper.exception_string()})
+        else:
+            self.render_json({'success': True, 'done': cursor is None, 'cursor': cursor, 'batch': mapper.counters, 'totals': totals})
+
+
+#------------------------------------------------------------------------------
+# Board Engine Benchmark
+#------------------------------------------------------------------------------
+
+class BoardBenchmark(object):
+    # Plays the same pseudo-random game on each board engine, timing the
+    # captures, mark_territory and count_territory paths and checking
+    # that every engine comes up with the same answers.
+
+    def __init__(self, board_size_index, moves=400, repeats=20, seed=CONST.Zobrist_Seed):
+        super(BoardBenchmark, self).__init__()
+        self.board_size_index = board_size_index
+        self.moves = moves
+        self.repeats = repeats
+        self.seed = seed
+
+    def _play(self, board, rnd):
+        width = board.get_width()
+        height = board.get_height()
+        color = CONST.Black_Color
+        previous_hash = None
+        results = []
+        for i in range(self.moves):
+            x = rnd.randrange(width)
+            y = rnd.randrange(height)
+            if board.get(x, y) != CONST.No_Color:
+                continue
+            position_hash = board.get_position_hash()
+            move = board.play(x, y, color)
+            if board.is_stone_in_suicide(x, y) or board.get_position_hash() == previous_hash:
+                board.undo(move)
+                continue
+            previous_hash = position_hash
+            results.append((x, y, move.ataris, len(move.captures)))
+            color = opposite_color(color)
+        return board, results
+
+    def _mark_dead(self, board, rnd):
+        for i in range(self.repeats):
+            x = rnd.randrange(board.get_width())
+            y = rnd.randrange(board.get_height())
+            piece = board.get(x, y)
+            if piece != CONST.No_Color and board.get_owner(x, y) == CONST.No_Color:
+                for stone_x, stone_y in board.compute_changed_stones(x, y):
+                    board.set_owner(stone_x, stone_y, opposite_color(piece))
+
+    def run_engine(self, engine):
+        rnd = random.Random(self.seed + self.board_size_index)
+        board = GameBoard(self.board_size_index)
+        board.use_engine(engine)
+
+        start = time.time()
+        board, moves = self._play(board, rnd)
+        captures_time = time.time() - start
+
+        self._mark_dead(board, rnd)
+        start = time.time()
+        for i in range(self.repeats):
+            board.mark_territory()
+        mark_time = time.time() - start
+
+        start = time.time()
+        for i in range(self.repeats):
+            territory = (board.count_territory(CONST.Black_Color), board.count_territory(CONST.White_Color))
+        count_time = time.time() - start
+
+        answers = (moves, board.get_state_string(), territory)
+        timings = {'captures_ms': captures_time * 1000.0, 'mark_territory_ms': mark_time * 1000.0, 'count_territory_ms': count_time * 1000.0}
+        return answers, timings
+
+    def run(self):
+        size = CONST.Board_Sizes[self.board_size_index]
+        result = {'board_size': "%dx%d" % size, 'moves': self.moves, 'repeats': self.repeats, 'engines': {}}
+        answers = []
+        for engine in [CONST.Chain_Engine, CONST.Bitboard_Engine]:
+            engine_answers, timings = self.run_engine(engine)
+            answers.append(engine_answers)
+            result['engines'][engine] = timings
+        result['identical'] = answers[0] == answers[1]
+        return result
+
+class BenchmarkBoardsHandler(GoHandler):
+    def get(self, *args):
+        try:
+            moves = int(self.request.get('moves', 400))
+            repeats = int(self.request.get('repeats', 20))
+            results = []
+            for board_size_index in range(len(CONST.Board_Sizes)):
+                results.append(BoardBenchmark(board_size_index, moves, repeats).run())
+        except:
+            self.render_json_as_text({'success': False, 'Error': ExceptionHelper.exception_string()})
+        else:
+            self.render_json_as_text({'success': True, 'configured_engine': CONST.Board_Engine, 'results': results})
+
+class CacheStatsHandler(GoHandler):
+    def get(self, *args):
+        self.render_json_as_text({'success': True, 'game_states': GameStateCache.get_stats(), 'games': GameCache.get_stats(), 'players': ModelCache.get_stats()})
+
+class _PythonLegacyUnpickler(pickle.Unpickler):
+    # The pure-Python way of doing what safe_pickle_loads does; only used
+    # for comparison by UnpicklerBenchmark.
+    def find_class(self, module, name):
+        return _pickle_find_global(module, name)
+
+class UnpicklerBenchmark(object):
+    # Decodes old-style state pickles (protocol 0, classes in __main__) on
+    # several threads at once, with both the pure-Python unpickler and
+    # safe_pickle_loads, checking every state that comes back.
+
+    def __init__(self, threads=4, loads=200, seed=CONST.Zobrist_Seed):
+        super(UnpicklerBenchmark, self).__init__()
+        self.threads = threads
+        self.loads = loads
+        self.seed = seed
+
+    def _legacy_blobs(self):
+        blobs = []
+        for board_size_index in range(len(CONST.Board_Sizes)):
+            board = GameBoard(board_size_index)
+            board, moves = BoardBenchmark(board_size_index, moves=200, seed=self.seed)._play(board, random.Random(self.seed))
+            state = GameState()
+            state.set_board(board)
+            blob = pickle.dumps(state).replace("c%s\n" % __name__, "c__main__\n")
+            blobs.append((blob, board.get_state_string()))
+        return blobs
+
+    def _python_loads(self, s):
+        return _PythonLegacyUnpickler(StringIO(s)).load()
+
+    def run_loads(self, loads, thread_count, blobs):
+        errors = []
+        def decode():
+            for i in range(self.loads):
+                blob, state_string = blobs[i % len(blobs)]
+                try:
+                    if loads(blob).get_board().get_state_string() != state_string:
+                        errors.append("wrong board")
+                except Exception:
+                    errors.append(ExceptionHelper.exception_string())
+        threads = [threading.Thread(target=decode) for i in range(thread_count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        return {'loads_per_second': (self.loads * thread_count) / elapsed, 'errors': len(errors), 'first_error': errors[0] if errors else None}
+
+    def run(self):
+        blobs = self._legacy_blobs()
+        results = []
+        thread_count = 1
+        while thread_count <= self.threads:
+            results.append({
+                'threads': thread_count,
+                'python_pickle': self.run_loads(self._python_loads, thread_count, blobs),
+                'safe_pickle_loads': self.run_loads(safe_pickle_loads, thread_count, blobs),
+            })
+            thread_count *= 2
+        return results
+
+class BenchmarkUnpicklerHandler(GoHandler):
+    def get(self, *args):
+        try:
+            threads = int(self.request.get('threads', 4))
+            loads = int(self.request.get('loads', 200))
+            results = UnpicklerBenchmark(threads, loads).run()
+        except:
+            self.render_json_as_text({'success': False, 'Error': ExceptionHelper.exception_string()})
+        else:
+            self.render_json_as_text({'success': True, 'results': results})
+
+
 #------------------------------------------------------------------------------
 # Export from GCP Datastore to JSON
 #------------------------------------------------------------------------------
@@ -3255,7 +5514,10 @@ class ExportGamesHandler(GoHandler):
 class ExportPlayersHandler(GoHandler):
     def get(self, *args):
         # get our request data
-        last_id_seen = int(self.request.get('last_id_seen', 0))
+        # (players keyed by cookie have names, which sort after ids)
+        last_id_seen = self.request.get('last_id_seen', '0')
+        if last_id_seen.isdigit():
+            last_id_seen = int(last_id_seen)
         amount = int(self.request.get('amount', 100))
 
         # get the games
@@ -3271,7 +5533,7 @@ class ExportPlayersHandler(GoHandler):
             jsonables.append(player.to_jsonable())
         response = {
             'players': jsonables,
-            'last_id_seen': players[-1].key().id() if players else 0
+            'last_id_seen': players[-1].key().id_or_name() if players else 0
         }
         return self.render_json(response)
 
@@ -3306,6 +5568,7 @@ url_map = [
     webapp2.Route(r'/service/create-game/', CreateGameHandler),
     webapp2.Route(r'/service/make-this-move/', MakeThisMoveHandler),
     webapp2.Route(r'/service/has-opponent-moved/', HasOpponentMovedHandler),
+    webapp2.Route(r'/service/legal-moves/', LegalMovesHandler),
     webapp2.Route(r'/service/mark-stone/', MarkStoneHandler),
     webapp2.Route(r'/service/has-opponent-scored/', HasOpponentScoredHandler),
     webapp2.Route(r'/service/done/', DoneHandler),
@@ -3319,6 +5582,10 @@ url_map = [
     webapp2.Route(r'/cron/send-reminders/', SendRemindersHandler),
     webapp2.Route(r'/cron/ensure-reminder-times/', EnsureReminderTimesHandler),
     webapp2.Route(r'/cron/update-database/', UpdateDatabaseHandler),
+    webapp2.Route(r'/cron/run-mapper/', RunMapperHandler),
+    webapp2.Route(r'/cron/benchmark-boards/', BenchmarkBoardsHandler),
+    webapp2.Route(r'/cron/benchmark-unpickler/', BenchmarkUnpicklerHandler),
+    webapp2.Route(r'/cron/cache-stats/', CacheStatsHandler),
     webapp2.Route(r'/export/games/', ExportGamesHandler),
     webapp2.Route(r'/export/players/', ExportPlayersHandler),
     webapp2.Route(r'/_ah/warmup', WarmupHandler),
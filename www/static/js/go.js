@@ -788,6 +788,9 @@ var GameBoardView = Class.create({
         this.click_callback = click_callback;
         this.hover_callback = null;
         this.showing_grid = show_grid;
+
+        // string of "1"/"0" per point (see /service/legal-moves/), or null
+        this.legal_moves = null;
         
         // generate the visuals
         this._make_board_dom(show_grid);
@@ -815,6 +818,21 @@ var GameBoardView = Class.create({
         this.showing_grid = false;
     },
 
+    set_legal_moves : function(legal_moves)
+    {
+        this.legal_moves = legal_moves;
+        this.update_dom();
+    },
+
+    is_legal_move : function(x, y)
+    {
+        if (this.legal_moves == null)
+        {
+            return true;
+        }
+        return this.legal_moves.charAt((y * this.width) + x) == "1";
+    },
+
     set_board : function(board)
     {
         // NOTE new board must have same size as old board
@@ -845,6 +863,10 @@ var GameBoardView = Class.create({
         }
         
         point.src = this._point_src(x, y);
+
+        // grey out empty points where a move isn't allowed
+        var is_illegal = (this.board.get_point(x, y) == CONST.No_Color) && !this.is_legal_move(x, y);
+        point.setOpacity(is_illegal ? 0.4 : 1.0);
     },
 
     observe_hovers : function(new_hover_callback)
@@ -1690,6 +1712,10 @@ var GameController = Class.create({
         {
             this.start_waiting_for_opponent();
         }
+        else if (this.is_your_move())
+        {
+            this.fetch_legal_moves();
+        }
     },
 
 
@@ -1877,6 +1903,7 @@ var GameController = Class.create({
         this.activate_show_previous_link();
         this.activate_pass_and_resign_links();
         this.show_captures_if_needed();
+        this.fetch_legal_moves();
     },
 
     become_opponents_move : function(black_stones_captured, white_stones_captured)
@@ -1891,6 +1918,7 @@ var GameController = Class.create({
         
         this.move_x = -1;
         this.move_y = -1;
+        this.board_view.set_legal_moves(null);
 
         this.activate_view_history_link();
         this.activate_show_previous_link();
@@ -2081,6 +2109,39 @@ var GameController = Class.create({
         );
     },
 
+    fetch_legal_moves : function()
+    {
+        var self = this;
+        var move_number = this.current_move_number;
+        new Ajax.Request(
+            "/service/legal-moves/",
+            {
+                method: 'POST',
+
+                parameters:
+                {
+                    "your_cookie": this.your_cookie
+                },
+
+                onSuccess : function(transport)
+                {
+                    var response = eval_json(transport.responseText);
+
+                    // ignore the answer if the game has moved on since we asked
+                    if (response['success'] && response['current_move_number'] == move_number && self.current_move_number == move_number)
+                    {
+                        self.board_view.set_legal_moves(response['legal_moves']);
+                    }
+                },
+
+                onFailure : function()
+                {
+                    // not essential; every point just stays clickable
+                }
+            }
+        );
+    },
+
     _opponent_has_moved : function(board_state_string, current_move_number, black_stones_captured, white_stones_captured, last_move_message, last_move_x, last_move_y, last_move_was_pass, white_territory, black_territory, scoring_number, game_is_scoring, you_win, opponent_wins, game_is_finished)
     {
         if (this.game_is_finished) {
@@ -2747,7 +2808,7 @@ var GameController = Class.create({
         else if (this.is_your_move())
         {
             var currently = this.board.get_point(x, y);
-            if (currently == CONST.No_Color || (x == this.move_x && y == this.move_y))
+            if ((currently == CONST.No_Color && this.board_view.is_legal_move(x, y)) || (x == this.move_x && y == this.move_y))
             {
                 this._click_board_move(x, y);
             }
@@ -3507,6 +3568,93 @@ var DatabaseUpdateController = Class.create({
         }
     },
     
+    reencode_games : function()
+    {
+        if (this.updating_database) { return; }
+        this._start_updating();
+        this._inner_run_mapper("reencode-games", null, null);
+    },
+
+    archive_finished_games : function()
+    {
+        if (this.updating_database) { return; }
+        this._start_updating();
+        this._inner_run_mapper("archive-finished-games", null, null);
+    },
+
+    key_players_by_cookie : function()
+    {
+        if (this.updating_database) { return; }
+        this._start_updating();
+        this._inner_run_mapper("key-players-by-cookie", null, null);
+    },
+
+    _inner_run_mapper : function(job, cursor, totals)
+    {
+        var self = this;
+
+        var parameters = {};
+        parameters["job"] = job;
+        if (cursor != null)
+        {
+            parameters["cursor"] = cursor;
+        }
+        if (totals != null)
+        {
+            parameters["totals"] = Object.toJSON(totals);
+        }
+
+        new Ajax.Request
+        (
+            "/cron/run-mapper/",
+            {
+                method: 'POST',
+                parameters: parameters,
+
+                onSuccess: function(result)
+                {
+                    var json = eval_json(result.responseText);
+                    if (json['success'])
+                    {
+                        self._handle_mapper_response(job, json['done'], json['cursor'], json['totals']);
+                    }
+                    else
+                    {
+                        self._stop_updating();
+                        alert("Database update failed. Please try again. Error: " + json['Error']);
+                    }
+                },
+
+                onFailure: function()
+                {
+                    self._stop_updating();
+                    alert("Database update network request failed. Please try again.");
+                }
+            }
+        );
+    },
+
+    _handle_mapper_response : function(job, done, cursor, totals)
+    {
+        var progress = "Modified " + totals['modified'].toString() + " out of " + totals['found'].toString() + " (" + totals['failed'].toString() + " failed)";
+        if (totals['bytes_before'] != null)
+        {
+            progress += "; " + totals['bytes_before'].toString() + " bytes down to " + totals['bytes_after'].toString();
+        }
+        progress += ".";
+
+        if (!done)
+        {
+            $("updating").innerHTML = "UPDATING: " + progress;
+            this._inner_run_mapper(job, cursor, totals);
+        }
+        else
+        {
+            this._stop_updating();
+            alert("Finished Updating! " + progress);
+        }
+    },
+
     _start_updating : function()
     {
         this.updating_database = true;